@@ -1,12 +1,30 @@
 """ PorousMaterials Calculation Plugin """
+import json
 import os
+from functools import partial
+import numpy as np
 import six
 
-from aiida.common import CalcInfo, CodeInfo
+from aiida.common import CalcInfo, CodeInfo, InputValidationError
 from aiida.engine import CalcJob
-from aiida.orm import Dict, FolderData, SinglefileData
+from aiida.orm import Dict, FolderData, RemoteData, SinglefileData
 from aiida.plugins import DataFactory
+from aiida_porousmaterials.calculations.caching import (
+    BASE_HASH_EXTRA, DATA_EXTRA, HASH_EXTRA, NODES_EXTRA, find_shared_data, folder_digest, folder_files,
+    get_input_hashes, get_node_digests
+)
 from aiida_porousmaterials.utils import PorousMaterialsInput
+from aiida_porousmaterials.utils.base_parser import (
+    DEFAULT_EV_SETTING, DEFAULT_HISTOGRAM_BINS, EnergyHistogram, get_temperatures
+)
+from aiida_porousmaterials.utils.input_generator import summary_setting
+from aiida_porousmaterials.utils.retrieved import (
+    NODE_FILTER_FILE, OUTPUT_ARCHIVE, OUTPUTS_FILE, SUMMARY_FILE, TIMINGS_FILE
+)
+from aiida_porousmaterials.utils.staging import (
+    DATA_ARCHIVE, INPUTS_ARCHIVE, file_opener, unpack_command, unpack_shared_command, write_archive
+)
+from aiida_porousmaterials.utils.voronoi_nodes import VoronoiNodes
 
 CifData = DataFactory('cif')  # pylint: disable=invalid-name
 
@@ -23,6 +41,12 @@ class PorousMaterialsCalculation(CalcJob):
     OUTPUT_FOLDER = 'Output'
     PROJECT_NAME = 'aiida'
     DEFAULT_PARSER = 'porousmaterials'
+    PARALLEL_MODES = ('serial', 'threads', 'distributed')
+    ENERGY_MODES = ('direct', 'grid')
+    RETRIEVAL_MODES = ('full', 'summary')
+    STAGING_MODES = ('files', 'archive')
+    PARSER_POOLS = ('thread', 'process')
+    SYSIMAGE_EXTRA = 'porousmaterials_sysimage'
 
     @classmethod
     def define(cls, spec):
@@ -43,6 +67,28 @@ class PorousMaterialsCalculation(CalcJob):
             help='Accessible Voronoi nodes calculated by Zeo++'
         )
 
+        spec.input_namespace(
+            'previous_ev_output_file',
+            valid_type=SinglefileData,
+            required=False,
+            dynamic=True,
+            help='ev_output_file of a previous calculation on the same framework, only missing pairs are computed'
+        )
+
+        spec.input(
+            'data',
+            valid_type=FolderData,
+            required=False,
+            help='PorousMaterials data folder (forcefields, molecules), staged instead of using data_path'
+        )
+
+        spec.input(
+            'parent_folder',
+            valid_type=RemoteData,
+            required=False,
+            help='remote_folder of an interrupted calculation, whose output files are resumed after their last row'
+        )
+
         spec.input('parameters', valid_type=Dict, required=True, help='parameters such as cutoff and mixing rules.')
         spec.input('settings', valid_type=Dict, required=False, help='Additional input parameters')
         spec.input('metadata.options.parser_name', valid_type=six.string_types, default=cls.DEFAULT_PARSER, non_db=True)
@@ -53,11 +99,33 @@ class PorousMaterialsCalculation(CalcJob):
             'output_parameters', valid_type=Dict, required=True, help='dictionary of calculated Voronoi energies'
         )
         spec.output_namespace('ev_output_file', valid_type=SinglefileData, required=False, dynamic=True)
+        spec.output(
+            'ev_output_archive',
+            valid_type=SinglefileData,
+            required=False,
+            help='gzipped tar archive of the output files, retrieved on request with the summary retrieval'
+        )
+        spec.output(
+            'ev_output_arrays',
+            valid_type=SinglefileData,
+            required=False,
+            help='per-node results of all output files as one compressed npz archive'
+        )
         # Exit codes
         spec.exit_code(
             100, 'ERROR_NO_RETRIEVED_FOLDER', message='The retrieved folder data node could not be accessed.'
         )
         spec.exit_code(101, 'ERROR_NO_OUTPUT_FILE', message='The retrieved folder does not contain an output file.')
+        spec.exit_code(
+            102,
+            'ERROR_INCOMPLETE_OUTPUT_FILE',
+            message='The calculation was interrupted before all nodes were written, restart it with parent_folder.'
+        )
+        spec.exit_code(
+            103,
+            'ERROR_RUN_FAILED',
+            message='The run failed before writing its timings, without leaving a truncated output file.'
+        )
 
         # Default output node
         spec.default_output_node = 'output_parameters'
@@ -73,23 +141,30 @@ class PorousMaterialsCalculation(CalcJob):
         parameters = self.inputs.parameters.get_dict()
 
         # get settings
-        settings = self.inputs.settings.get_dict() if 'setting' in self.inputs else {}
+        settings = self.inputs.settings.get_dict() if 'settings' in self.inputs else {}
+        parameters = self._checked_parameters(parameters, settings)
 
-        # if 'setting' in self.inputs:
-        #     settings = self.inputs.settings.get_dict()
-        # else:
-        #     settings = {}
+        # Lines of the job script unpacking the staged archives.
+        staging_text = []
+        if 'data' in self.inputs:
+            parameters, staging_text = self._stage_data(folder, parameters, settings)
 
-        # Writing the input
-        inp = PorousMaterialsInput(parameters)
+        # Content hashes of the inputs, used to find reusable calculations (see `caching`), only with `data`.
+        full_hash, base_hash = get_input_hashes(self.inputs)
+        if full_hash is not None:
+            self.node.set_extra_many({
+                HASH_EXTRA: full_hash,
+                BASE_HASH_EXTRA: base_hash,
+                NODES_EXTRA: get_node_digests(self.inputs),
+            })
 
+        # Writing the input
+        input_text, output_paths = self._render_input(parameters)
         with open(folder.get_abs_path(self.INPUT_FILE), 'w') as fobj:
-            fobj.write(inp.render())
+            fobj.write(input_text)
 
         # create code information
-        codeinfo = CodeInfo()
-        codeinfo.cmdline_params = settings.pop('cmdline', []) + [self.INPUT_FILE]
-        codeinfo.code_uuid = self.inputs.code.uuid
+        codeinfo = self._code_info(parameters, settings)
 
         # Create calc information
         calcinfo = CalcInfo()
@@ -98,20 +173,262 @@ class PorousMaterialsCalculation(CalcJob):
         calcinfo.cmdline_params = codeinfo.cmdline_params
         calcinfo.codes_info = [codeinfo]
 
-        # file list
+        # Input files copied from the repository, as (node, name in the working directory),
+        # and written to the sandbox.
+        copies = [(fobj, name + '.cif') for name, fobj in self.inputs.structure.items()]
+        node_copies, written, node_filter = self._filter_nodes(folder, parameters)
+        staging_text += self._stage_inputs(folder, calcinfo, copies + node_copies, written, settings)
+
+        # The output files of an interrupted calculation, which the templates complete instead of starting over.
+        if 'parent_folder' in self.inputs:
+            parent = self.inputs.parent_folder
+            if parent.computer.uuid != self.inputs.code.computer.uuid:
+                raise InputValidationError('parent_folder must be on the computer of the code')
+            calcinfo.remote_copy_list = [(
+                parent.computer.uuid, os.path.join(parent.get_remote_path(), self.OUTPUT_FOLDER), self.OUTPUT_FOLDER
+            )]
+
+        # The start of the job, from which the templates time the Julia startup.
+        prepend_text = staging_text + ['export PM_START_TIME=$(date +%s.%N)']
+        if parameters.get('parallel', 'serial') == 'threads':
+            prepend_text.append('export JULIA_NUM_THREADS={}'.format(self._num_procs()))
+        calcinfo.prepend_text = '\n'.join(prepend_text)
+
+        self._set_retrieve_list(folder, calcinfo, settings, node_filter, output_paths)
+        return calcinfo
+
+    def _num_procs(self):
+        """Number of MPI slots per machine, used by the node loop as threads or Distributed workers."""
+        return self.inputs.metadata.options.resources.get('num_mpiprocs_per_machine', 1)
+
+    def _checked_parameters(self, parameters, settings):
+        """
+        Validate the modes of parameters and settings. Returns the parameters
+        completed with the reused pairs and the remote summary settings.
+        """
+        # The node loop may use all the MPI slots of the machine, as threads or Distributed workers.
+        parallel = parameters.get('parallel', 'serial')
+        if parallel not in self.PARALLEL_MODES:
+            raise InputValidationError('parallel must be one of {}'.format(', '.join(self.PARALLEL_MODES)))
+        if parallel != 'serial' and self.inputs.metadata.options.withmpi:
+            raise InputValidationError(
+                "parallel='{}' runs a single Julia process, set withmpi to False".format(parallel)
+            )
+        # Node energies are either evaluated directly or interpolated in a precomputed energy grid.
+        if parameters.get('energy_mode', 'direct') not in self.ENERGY_MODES:
+            raise InputValidationError('energy_mode must be one of {}'.format(', '.join(self.ENERGY_MODES)))
+        if settings.get('staging', 'files') not in self.STAGING_MODES:
+            raise InputValidationError('staging must be one of {}'.format(', '.join(self.STAGING_MODES)))
+        # Output files parsed concurrently with parser_workers go to a pool of threads or processes.
+        if settings.get('parser_pool', 'thread') not in self.PARSER_POOLS:
+            raise InputValidationError('parser_pool must be one of {}'.format(', '.join(self.PARSER_POOLS)))
+
+        if 'previous_ev_output_file' in self.inputs:
+            if parameters.get('batch', False):
+                raise InputValidationError('previous_ev_output_file is not supported in batch mode')
+            parameters = self._reused_pairs(parameters)
+
+        # With 'summary' retrieval the templates reduce the output files where they are written,
+        # and only the summaries are retrieved; the files stay on the remote or come back archived.
+        retrieval = settings.get('output_retrieval', 'full')
+        if retrieval not in self.RETRIEVAL_MODES:
+            raise InputValidationError('output_retrieval must be one of {}'.format(', '.join(self.RETRIEVAL_MODES)))
+        if retrieval == 'summary':
+            if settings.get('output_storage', 'csv') == 'npz':
+                raise InputValidationError("output_storage='npz' needs the full output files retrieved")
+            bins = settings.get('histogram_bins', None) or DEFAULT_HISTOGRAM_BINS
+            bin_edges = EnergyHistogram(settings.get('histogram_range', None), bins).bin_edges
+            ev_setting = parameters.get('ev_setting', DEFAULT_EV_SETTING)
+            setting = summary_setting(ev_setting, bin_edges, get_temperatures(parameters))
+            parameters = dict(parameters, summary_setting=setting)
+        return parameters
+
+    def _code_info(self, parameters, settings):
+        """CodeInfo running the input with Julia, with the workers and sysimage options."""
+        codeinfo = CodeInfo()
+        julia_options = []
+        if parameters.get('parallel', 'serial') == 'distributed':
+            julia_options += ['-p', str(self._num_procs())]
+        # A PackageCompiler sysimage with PorousMaterials baked in skips its loading and JIT compilation.
+        sysimage = settings.get('sysimage', self.inputs.code.get_extra(self.SYSIMAGE_EXTRA, None))
+        if sysimage:
+            julia_options += ['--sysimage', sysimage]
+        codeinfo.cmdline_params = julia_options + settings.pop('cmdline', []) + [self.INPUT_FILE]
+        codeinfo.code_uuid = self.inputs.code.uuid
+        return codeinfo
+
+    def _filter_nodes(self, folder, parameters):
+        """
+        Voronoi node files to stage: those copied from the repository as (node, name in the working
+        directory), those written to the sandbox after the filters, and the number of Voronoi nodes
+        skipped by the filters, by node file, for the parser.
+        """
+        copies = []
+        written = []
+        node_filter = {}
+        # Nodes within node_tolerance (Angstrom) of an evaluated node are weighted into its multiplicity.
+        tolerance = parameters.get('node_tolerance', None)
+        # Nodes smaller than node_min_radius (Angstrom) or beyond the node_max_number largest are skipped.
+        min_radius = parameters.get('node_min_radius', None)
+        max_nodes = parameters.get('node_max_number', None)
+        for name, fobj in self.inputs.acc_voronoi_nodes.items():
+            if tolerance is None and min_radius is None and max_nodes is None:
+                copies.append((fobj, name + '.voro_accessible'))
+                continue
+            with fobj.open(mode='r') as handle:
+                nodes = VoronoiNodes.from_handle(handle)
+            reduced = nodes if tolerance is None else nodes.deduplicate(self._framework_cell(name), tolerance)
+            if min_radius is not None or max_nodes is not None:
+                reduced = reduced.select(min_radius=min_radius, max_nodes=max_nodes)
+                if not reduced.radii.size:
+                    raise InputValidationError('No Voronoi node of {} is left after filtering'.format(name))
+                node_filter[name] = {
+                    'total': len(nodes.radii),
+                    'evaluated': len(reduced.radii),
+                    'skipped': len(nodes.radii) - reduced.represented,
+                }
+            with open(folder.get_abs_path(name + '.voro_accessible'), 'w') as handle:
+                reduced.write(handle)
+            written.append(name + '.voro_accessible')
+        return copies, written, node_filter
+
+    @staticmethod
+    def _stage_inputs(folder, calcinfo, copies, written, settings):
+        """
+        Stage the input files copied from the repository and written to the sandbox, and set the
+        local_copy_list. Returns the lines of the job script unpacking them, if any.
+        """
+        # With the 'archive' staging, all input files go in one compressed archive unpacked by the job script,
+        # which saves the per-file overhead of the transport.
+        if settings.get('staging', 'files') != 'archive':
+            calcinfo.local_copy_list = [(fobj.uuid, fobj.filename, target) for fobj, target in copies]
+            return []
+        members = [(target, partial(fobj.open, mode='rb')) for fobj, target in copies]
+        members += [(target, file_opener(folder.get_abs_path(target))) for target in written]
+        write_archive(folder.get_abs_path(INPUTS_ARCHIVE), members)
+        for target in written:
+            folder.remove_path(target)
         calcinfo.local_copy_list = []
+        return [unpack_command(INPUTS_ARCHIVE)]
+
+    def _set_retrieve_list(self, folder, calcinfo, settings, node_filter, output_paths):
+        """
+        Set the files retrieved with the output retrieval of settings, and write the node_filter
+        and the output_paths which the parser reads back.
+        """
+        if settings.get('output_retrieval', 'full') == 'summary':
+            calcinfo.retrieve_list = [SUMMARY_FILE, TIMINGS_FILE]
+            if settings.get('retrieve_archive', False):
+                calcinfo.append_text = 'tar czf {} {}'.format(OUTPUT_ARCHIVE, self.OUTPUT_FOLDER)
+                calcinfo.retrieve_list.append(OUTPUT_ARCHIVE)
+        else:
+            calcinfo.retrieve_list = [self.OUTPUT_FOLDER, TIMINGS_FILE]
+        if node_filter:
+            with open(folder.get_abs_path(NODE_FILTER_FILE), 'w') as handle:
+                json.dump(node_filter, handle)
+            calcinfo.retrieve_list.append(NODE_FILTER_FILE)
+        # The parser checks that the run wrote all of them.
+        if output_paths is not None:
+            with open(folder.get_abs_path(OUTPUTS_FILE), 'w') as handle:
+                json.dump(output_paths, handle)
+            calcinfo.retrieve_list.append(OUTPUTS_FILE)
 
-        if 'structure' in self.inputs:
-            for name, fobj in self.inputs.structure.items():
-                calcinfo.local_copy_list.append((fobj.uuid, fobj.filename, name + '.cif'))
+    def _stage_data(self, folder, parameters, settings):
+        """
+        Stage the `data` folder and point data_path to it. With settings['shared_data_root'], it is
+        unpacked once per content to <shared_data_root>/<digest> on the computer and only uploaded
+        while no finished calculation has used it there, otherwise it goes to the working directory.
+        Calculations submitted together all upload it, as none of them has finished yet; the first job
+        to run unpacks it and the others keep that copy (see `unpack_shared_command`).
+        Returns the parameters and the lines of the job script unpacking the data, if any.
+        """
+        data = self.inputs.data
+        root = settings.get('shared_data_root', None)
+        if root is None:
+            members = [('data/' + key, partial(data.open, key, mode='rb')) for key in folder_files(data)]
+            write_archive(folder.get_abs_path(DATA_ARCHIVE), members)
+            return dict(parameters, data_path='data'), [unpack_command(DATA_ARCHIVE)]
+
+        data_path = os.path.join(root, folder_digest(data))
+        self.node.set_extra(DATA_EXTRA, data_path)
+        if find_shared_data(data_path, self.node.computer):
+            return dict(parameters, data_path=data_path), []
+        members = [(key, partial(data.open, key, mode='rb')) for key in folder_files(data)]
+        write_archive(folder.get_abs_path(DATA_ARCHIVE), members)
+        return dict(parameters, data_path=data_path), [unpack_shared_command(DATA_ARCHIVE, data_path)]
+
+    def _reused_pairs(self, parameters):
+        """
+        Leave out of the plan the (probe, adsorbate) pairs of previous_ev_output_file, whose names end
+        with _<probe>_<adsorbate> as the outputs of the multi-component templates. The probes are still
+        told apart with the full adsorbates, see `plan_entries`.
+        """
+        reused_pairs = sorted({tuple(name.split('_')[-2:]) for name in self.inputs.previous_ev_output_file})
+        return dict(parameters, reused_pairs=reused_pairs)
 
-        if 'acc_voronoi_nodes' in self.inputs:
-            for name, fobj in self.inputs.acc_voronoi_nodes.items():
-                calcinfo.local_copy_list.append((fobj.uuid, fobj.filename, name + '.voro_accessible'))
+    def _framework_name(self, nodes_name):
+        """Name of the framework the Voronoi nodes nodes_name belong to, the longest prefix of nodes_name."""
+        frameworks = [name for name in self.inputs.structure if nodes_name.startswith(name)]
+        if not frameworks:
+            raise InputValidationError('No structure matches the Voronoi nodes {}'.format(nodes_name))
+        return max(frameworks, key=len)
 
-        calcinfo.retrieve_list = [self.OUTPUT_FOLDER]
+    def _framework_cell(self, nodes_name):
+        """Lattice vectors (as rows) of the framework the Voronoi nodes nodes_name belong to."""
+        return np.array(self.inputs.structure[self._framework_name(nodes_name)].get_ase().get_cell())
 
-        return calcinfo
+    def _render_input(self, parameters):
+        """
+        Render the input template. In batch mode, the template is rendered once
+        per entry of the `structure` namespace, so that all frameworks are evaluated
+        in the same Julia process and write to their own output subfolder; the timings
+        and summaries are written once, after the last of them. Returns the input and
+        the paths of the output files it writes, None if they are not known.
+        """
+        if not parameters.get('batch', False):
+            node_names = sorted(self.inputs.acc_voronoi_nodes)
+            inputs = [self._checked_input(dict(parameters, output_dir=self.OUTPUT_FOLDER, node_names=node_names))]
+        else:
+            inputs = []
+            for name in sorted(self.inputs.structure):
+                framework_parameters = dict(
+                    parameters,
+                    framework=name + '.cif',
+                    frameworkname=name,
+                    output_dir='/'.join([self.OUTPUT_FOLDER, name]),
+                    node_names=[
+                        nodes_name for nodes_name in sorted(self.inputs.acc_voronoi_nodes)
+                        if self._framework_name(nodes_name) == name
+                    ],
+                )
+                if 'output_filename' in parameters:
+                    framework_parameters['output_filename'] = 'Ev_{}.csv'.format(name)
+                inputs.append(self._checked_input(framework_parameters))
+
+        text = '\n'.join(
+            inp.render(preamble=index == 0, epilogue=index == len(inputs) - 1) for index, inp in enumerate(inputs)
+        )
+        output_files = [inp.output_files() for inp in inputs]
+        if any(files is None for files in output_files):
+            return text, None
+        return text, [path for files in output_files for path in files]
+
+    @staticmethod
+    def _checked_input(parameters):
+        """
+        PorousMaterialsInput of parameters, which must set all the placeholders of its template
+        and, if it generates the plan, have the node files of its adsorbates and evaluate something.
+        """
+        inp = PorousMaterialsInput(parameters)
+        missing = inp.missing_parameters()
+        if missing:
+            raise InputValidationError('Missing parameters: {}'.format(', '.join(missing)))
+        missing = inp.missing_node_files()
+        if missing:
+            raise InputValidationError('Missing acc_voronoi_nodes: {}'.format(', '.join(missing)))
+        if inp.entries is not None and not inp.entries:
+            raise InputValidationError('Nothing to evaluate for {}'.format(parameters['frameworkname']))
+        return inp
 
 
 # EOF
@@ -0,0 +1,174 @@
+"""Reuse of finished PorousMaterials calculations with the same physical inputs."""
+import hashlib
+
+from aiida.engine import submit
+from aiida.orm import CalcJobNode, QueryBuilder
+from aiida.orm.utils.repository import FileType
+from aiida_porousmaterials.utils.input_hash import (
+    file_digest, get_adsorbates, input_hash, matching_outputs, output_node_file
+)
+
+HASH_EXTRA = 'porousmaterials_input_hash'
+BASE_HASH_EXTRA = 'porousmaterials_base_hash'
+# Digests of the Voronoi node files the output files of a calculation were computed on, by name.
+NODES_EXTRA = 'porousmaterials_node_digests'
+PROCESS_TYPE = 'aiida.calculations:porousmaterials'
+# Shared remote directory a calculation unpacked its `data` folder to.
+DATA_EXTRA = 'porousmaterials_shared_data'
+
+
+def _digests(namespace):
+    """Content digests of the files of an input namespace, by name."""
+    digests = {}
+    for name, node in namespace.items():
+        with node.open(mode='rb') as handle:
+            digests[name] = file_digest(handle)
+    return digests
+
+
+def folder_files(node, key=None):
+    """Sorted keys of all the files of a FolderData, recursively."""
+    keys = []
+    for obj in node.list_objects(key):
+        path = obj.name if key is None else '/'.join([key, obj.name])
+        if obj.type == FileType.DIRECTORY:
+            keys.extend(folder_files(node, path))
+        else:
+            keys.append(path)
+    return sorted(keys)
+
+
+def folder_digest(node):
+    """Content digest of a FolderData, of the keys and contents of all its files."""
+    digest = hashlib.sha256()
+    for key in folder_files(node):
+        with node.open(key, mode='rb') as handle:
+            digest.update('{}\0{}\0'.format(key, file_digest(handle)).encode('utf8'))
+    return digest.hexdigest()
+
+
+def get_input_hashes(inputs):
+    """
+    Hash of the physically relevant inputs of a builder or of a calculation
+    (its `inputs`), and the same hash without the adsorbates. Both are None
+    without the `data` input: the force field and molecule files of a data_path
+    on the computer are not hashed, and may change under the same names.
+    """
+    if 'data' not in inputs:
+        return None, None
+    structures = _digests(inputs['structure'])
+    acc_voronoi_nodes = _digests(inputs['acc_voronoi_nodes'])
+    parameters = inputs['parameters'].get_dict()
+    settings = inputs['settings'].get_dict() if 'settings' in inputs else {}
+    data = folder_digest(inputs['data'])
+    return (
+        input_hash(structures, acc_voronoi_nodes, parameters, settings, data=data),
+        input_hash(structures, acc_voronoi_nodes, parameters, settings, with_adsorbates=False, data=data),
+    )
+
+
+def get_node_digests(inputs):
+    """
+    Digests of the Voronoi node files of a builder or of a calculation (its `inputs`) by name, and
+    of those the previous_ev_output_file were computed on, as recorded by their calculation.
+    """
+    digests = {}
+    previous = inputs['previous_ev_output_file'] if 'previous_ev_output_file' in inputs else {}
+    for name, node in previous.items():
+        recorded = node.creator.get_extra(NODES_EXTRA, {}) if node.creator is not None else {}
+        if output_node_file(name) in recorded:
+            digests[output_node_file(name)] = recorded[output_node_file(name)]
+    digests.update(_digests(inputs['acc_voronoi_nodes']))
+    return digests
+
+
+def _finished_calculations(filters):
+    """Successfully finished PorousMaterialsCalculation nodes matching the extra filters, newest first."""
+    filters = dict(filters, process_type=PROCESS_TYPE)
+    filters['attributes.exit_status'] = 0
+    query = QueryBuilder().append(CalcJobNode, filters=filters, tag='calc')
+    query.order_by({'calc': {'ctime': 'desc'}})
+    return [calc for calc, in query.iterall()]
+
+
+def find_shared_data(data_path, computer):
+    """
+    Whether a finished calculation on computer already unpacked its `data` folder to data_path.
+    Calculations which are only stored are not counted: their job may not run, or fail before unpacking.
+    """
+    return bool(_finished_calculations({'extras.' + DATA_EXTRA: data_path, 'dbcomputer_id': computer.pk}))
+
+
+def find_cached_calculation(builder):
+    """The newest finished calculation with the same physical inputs as builder, or None."""
+    full_hash, _ = get_input_hashes(builder)
+    if full_hash is None:
+        return None
+    calculations = _finished_calculations({'extras.' + HASH_EXTRA: full_hash})
+    return calculations[0] if calculations else None
+
+
+def reusable_output_files(calc):
+    """
+    Ev output files of a finished calculation, by name: its `ev_output_file` outputs and the
+    `previous_ev_output_file` inputs it took over, so that files are found through a chain of
+    incremental calculations. Calculations with the 'npz' output storage or the 'summary' output
+    retrieval keep no output files, and have none to reuse.
+    """
+    files = {
+        link.link_label.split('__', 1)[1]: link.node
+        for link in calc.get_incoming(link_label_filter='previous_ev_output_file__%').all()
+    }
+    for link in calc.get_outgoing(link_label_filter='ev_output_file__%').all():
+        files[link.link_label.split('__', 1)[1]] = link.node
+    return files
+
+
+def find_reusable_adsorbates(builder):
+    """
+    Adsorbates of which finished calculations differing from builder only by their adsorbates
+    have output files (see `reusable_output_files`) computed on the Voronoi node files of builder,
+    mapped to the newest such calculation.
+    """
+    _, base_hash = get_input_hashes(builder)
+    reusable = {}
+    if base_hash is None:
+        return reusable
+    digests = get_node_digests(builder)
+    for calc in _finished_calculations({'extras.' + BASE_HASH_EXTRA: base_hash}):
+        for name in matching_outputs(reusable_output_files(calc), digests, calc.get_extra(NODES_EXTRA, {})):
+            reusable.setdefault(name.split('_')[-1], calc)
+    return reusable
+
+
+def attach_previous_outputs(builder):
+    """
+    Set builder.previous_ev_output_file to the output files of the finished calculations
+    which differ from builder only by their adsorbates, so that only the missing adsorbates
+    are computed. Returns the adsorbates taken over. Nothing is taken over from calculations
+    without output files, which is always the case with the 'npz' output storage.
+    """
+    adsorbates = get_adsorbates(builder.parameters.get_dict())
+    reusable = find_reusable_adsorbates(builder)
+    digests = get_node_digests(builder)
+    previous = {}
+    for calc in {calc.pk: calc for calc in reusable.values()}.values():
+        files = reusable_output_files(calc)
+        for name in matching_outputs(files, digests, calc.get_extra(NODES_EXTRA, {})):
+            adsorbate = name.split('_')[-1]
+            if adsorbate in adsorbates and reusable[adsorbate].pk == calc.pk:
+                previous[name] = files[name]
+    if previous:
+        builder.previous_ev_output_file = previous
+    return sorted({name.split('_')[-1] for name in previous})
+
+
+def submit_or_reuse(builder):
+    """Submit builder, unless an identical calculation already finished, which is returned instead."""
+    calc = find_cached_calculation(builder)
+    if calc is not None:
+        return calc
+    return submit(builder)
+
+
+# EOF
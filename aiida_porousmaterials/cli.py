@@ -0,0 +1,41 @@
+"""Command line interface of the AiiDA-PorousMaterials plugin."""
+import os
+
+import click
+
+from aiida.cmdline.utils import decorators, echo
+
+
+@click.group('aiida-porousmaterials')
+def cli():
+    """Tools for PorousMaterials calculations."""
+
+
+@cli.command('export')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.option('-F',
+              '--format',
+              'export_format',
+              type=click.Choice(['csv', 'parquet']),
+              default=None,
+              help='Format of the table, by default from the extension of OUTPUT.')
+@click.option('-G', '--group', default=None, help='Only export the calculations of the group with this label.')
+@click.option('-b', '--batch-size', type=click.INT, default=1000, show_default=True, help='Rows fetched per query.')
+@click.option('-p',
+              '--percentiles',
+              default='90,80,50',
+              show_default=True,
+              help='Comma separated ev_setting of the calculations, one column per percentile.')
+@decorators.with_dbenv()
+def export(output, export_format, group, batch_size, percentiles):
+    """Export the Ev results of the finished calculations to OUTPUT, one row per framework, probe and adsorbate."""
+    from aiida_porousmaterials.export import export_results
+
+    if export_format is None:
+        export_format = 'parquet' if os.path.splitext(output)[1] == '.parquet' else 'csv'
+    percentiles = [value.strip() for value in percentiles.split(',') if value.strip()]
+    number = export_results(output, export_format, group, batch_size, percentiles)
+    echo.echo_success('exported {} rows to {}'.format(number, output))
+
+
+# EOF
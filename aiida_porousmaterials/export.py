@@ -0,0 +1,162 @@
+"""Export of the screening results of many PorousMaterials calculations as one table."""
+import csv
+import itertools
+
+from aiida.orm import CalcJobNode, Dict, Group, QueryBuilder, WorkChainNode
+from aiida_porousmaterials.calculations.caching import PROCESS_TYPE
+from aiida_porousmaterials.workflows import SHARD_EXTRA, SHARDS_EXTRA, SHARDED_PROCESS_TYPE
+from aiida_porousmaterials.utils.base_parser import DEFAULT_EV_SETTING, is_temperature_key
+
+# Scalar results of every (framework, probe, adsorbate), see `ev_results`, and their types.
+RESULT_COLUMNS = {
+    'Ev_minimum': float,
+    'Ev_maximum': float,
+    'Ev_boltzmann_average': float,
+    'average_boltzmann_factor': float,
+    'boltzmann_factor_sum': float,
+    'weighted_energy_sum': float,
+    'framework_density': float,
+    'temperature': float,
+    'total_number_of_accessible_Voronoi_nodes': int,
+    'number_of_evaluated_Voronoi_nodes': int,
+    'Ev_percentiles_method': str,
+    'energy_mode': str,
+}
+KEY_COLUMNS = {'pk': int, 'framework': str, 'adsorbate': str, 'probe': str}
+# Entries of output_parameters about the calculation rather than a pair.
+CALCULATION_KEYS = ('Voronoi_nodes_filter', 'timings')
+
+
+def export_columns(percentiles=None):
+    """Columns of the exported table and their types, with one column per energy percentile."""
+    percentiles = DEFAULT_EV_SETTING if percentiles is None else percentiles
+    columns = dict(KEY_COLUMNS, **RESULT_COLUMNS)
+    columns.update({'Ev_percentile_{}'.format(percentile): float for percentile in percentiles})
+    return columns
+
+
+def result_rows(output_parameters, framework=None, keys=()):
+    """
+    Flat rows of the results nested in output_parameters as the parser builds them,
+    i.e. {adsorbate: {<probe>_probe: results}}, below a framework level in batch mode
+    and a temperature level with several temperatures, told apart by the temperature column.
+    framework names the framework of a calculation which is not in batch mode.
+    """
+    for key, value in output_parameters.items():
+        if not isinstance(value, dict) or key in CALCULATION_KEYS:
+            continue
+        if 'Ev_minimum' not in value:
+            yield from result_rows(value, framework, keys if is_temperature_key(key) else keys + (key,))
+            continue
+        row = {column: value.get(column) for column in RESULT_COLUMNS}
+        for percentile, energy in value.get('Ev_percentiles', {}).items():
+            row['Ev_percentile_' + percentile] = energy
+        row['framework'] = keys[0] if len(keys) > 1 else framework
+        row['adsorbate'] = keys[-1] if keys else None
+        row['probe'] = key[:-len('_probe')] if key.endswith('_probe') else key
+        yield row
+
+
+def _query_outputs(process_class, filters, parameters_label, group=None, batch_size=1000):
+    """
+    (pk, frameworkname, output_parameters) of the processes of process_class matching filters,
+    of a group if given, projected by a single query fetched batch_size rows at a time.
+    """
+    query = QueryBuilder()
+    if group is None:
+        query.append(process_class, filters=filters, project=['id'], tag='process')
+    else:
+        query.append(Group, filters={'label': group}, tag='group')
+        query.append(process_class, filters=filters, with_group='group', project=['id'], tag='process')
+    query.append(
+        Dict, with_outgoing='process', edge_filters={'label': parameters_label}, project=['attributes.frameworkname']
+    )
+    query.append(Dict, with_incoming='process', edge_filters={'label': 'output_parameters'}, project=['attributes'])
+    query.order_by({'process': {'id': 'asc'}})
+    return query.iterall(batch_size=batch_size)
+
+
+def query_results(group=None, batch_size=1000):
+    """
+    (pk, frameworkname, output_parameters) of the finished calculations, of a group if given, without
+    loading any node. The calculations of the shards of a PorousMaterialsShardedWorkChain only hold part
+    of the nodes, so they are left out and the merged outputs of the workchain are exported instead.
+    """
+    calculations = _query_outputs(
+        CalcJobNode,
+        {'process_type': PROCESS_TYPE, 'attributes.exit_status': 0, 'extras': {'!has_key': SHARD_EXTRA}},
+        'parameters', group, batch_size
+    )
+    workchains = _query_outputs(
+        WorkChainNode,
+        {'process_type': SHARDED_PROCESS_TYPE, 'attributes.exit_status': 0, 'extras': {'has_key': SHARDS_EXTRA}},
+        'porousmaterials__parameters', group, batch_size
+    )
+    return itertools.chain(calculations, workchains)
+
+
+def iter_rows(group=None, batch_size=1000):
+    """Rows of the table, one per framework, probe and adsorbate of every finished calculation."""
+    for pk, framework, output_parameters in query_results(group, batch_size):
+        for row in result_rows(output_parameters, framework):
+            row['pk'] = pk
+            yield row
+
+
+def write_csv(rows, path, columns):
+    """Stream rows to the CSV file path, returning the number of rows."""
+    number = 0
+    with open(path, 'w', newline='') as handle:
+        writer = csv.DictWriter(handle, fieldnames=list(columns), extrasaction='ignore')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            number += 1
+    return number
+
+
+def write_parquet(rows, path, columns, batch_size=1000):
+    """Stream rows to the Parquet file path in row groups of batch_size rows, returning the number of rows."""
+    import pyarrow as pa  # pylint: disable=import-outside-toplevel
+    import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+
+    types = {float: pa.float64(), int: pa.int64(), str: pa.string()}
+    schema = pa.schema([(column, types[kind]) for column, kind in columns.items()])
+    number = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                writer.write_table(_arrow_table(pa, batch, schema))
+                number += len(batch)
+                batch = []
+        if batch or not number:
+            writer.write_table(_arrow_table(pa, batch, schema))
+            number += len(batch)
+    return number
+
+
+def _arrow_table(pa, rows, schema):  # pylint: disable=invalid-name
+    """Arrow table of rows with the given schema."""
+    return pa.table({field.name: pa.array([row.get(field.name) for row in rows], type=field.type) for field in schema},
+                    schema=schema)
+
+
+EXPORT_FORMATS = {'csv': write_csv, 'parquet': write_parquet}
+
+
+def export_results(path, export_format='csv', group=None, batch_size=1000, percentiles=None):
+    """
+    Export the results of all finished PorousMaterials calculations, or of a group,
+    to path with one row per framework, probe and adsorbate. Rows are streamed, so
+    the memory does not depend on the number of calculations. Returns the number of rows.
+    """
+    columns = export_columns(percentiles)
+    rows = iter_rows(group, batch_size)
+    if export_format == 'parquet':
+        return write_parquet(rows, path, columns, batch_size)
+    return EXPORT_FORMATS[export_format](rows, path, columns)
+
+
+# EOF
@@ -1,12 +1,18 @@
 """PorousMaterials Output Parse"""
 import os
-import re
+import tempfile
+from functools import partial
 
-from aiida.common import NotExistent, OutputParsingError
+from aiida.common import NotExistent
 from aiida.engine import ExitCode
 from aiida.orm import Dict, SinglefileData
 from aiida.parsers.parser import Parser
-from aiida_porousmaterials.utils import parse_base_output
+from aiida_porousmaterials.utils.base_parser import IncompleteOutputError
+from aiida_porousmaterials.utils.ev_arrays import EV_ARRAYS_FILENAME, write_ev_arrays
+from aiida_porousmaterials.utils.retrieved import (
+    OUTPUT_ARCHIVE, SUMMARY_FILE, TIMINGS_FILE, list_output_files, missing_outputs, parse_retrieved,
+    truncated_outputs
+)
 
 
 class PorousMaterialsParser(Parser):
@@ -26,31 +32,69 @@ class PorousMaterialsParser(Parser):
 
         output_folder_name = self.node.process_class.OUTPUT_FOLDER
 
-        if output_folder_name not in output_folder._repository.list_object_names():  # pylint: disable=protected-access
-            return self.exit_codes.ERROR_NO_OUTPUT_FILE
+        settings = self.node.inputs.settings.get_dict() if 'settings' in self.node.inputs else {}
+        parameters = self.node.inputs.parameters.get_dict()
+        # 'csv' keeps every output file as a SinglefileData, 'npz' stores all per-node columns in one archive.
+        storage = settings.get('output_storage', 'csv')
 
-        output_parameters = {}
-        ev_output_file = {}
+        # The files are read through handles of the retrieved node, whatever its repository backend is.
+        output_files = list_output_files(output_folder, parameters.get('batch', False), output_folder_name)
 
-        output_files = output_folder._repository.list_object_names(self.node.process_class.OUTPUT_FOLDER)  # pylint: disable=protected-access
+        exit_code = self._check_outputs(output_folder, output_files)
+        if exit_code is not None:
+            return exit_code
 
-        for fname in output_files:
-            output_abs_path = os.path.join(
-                output_folder._repository._get_base_folder().abspath,  # pylint: disable=protected-access
-                self.node.process_class.OUTPUT_FOLDER,
-                fname
+        previous = {
+            link.link_label.split('__', 1)[1]: partial(link.node.open, mode='r')
+            for link in self.node.get_incoming(link_label_filter='previous_ev_output_file__%').all()
+        }
+        try:
+            output_parameters, ev_arrays = parse_retrieved(
+                output_folder, parameters, settings, previous=previous, output_files=output_files
             )
-            ev_output_file[fname[:-4]] = SinglefileData(file=output_abs_path)
-            dict_key1 = fname[:-4].split('_')[-1]
-            dict_key2 = fname[:-4].split('_')[-2]
-            if dict_key1 not in output_parameters.keys():
-                output_parameters[dict_key1] = {}
-            output_parameters[dict_key1][dict_key2 + '_probe'] = parse_base_output(output_abs_path)
-
-        self.out('ev_output_file', ev_output_file)
+        except IncompleteOutputError as exception:
+            self.logger.error('Incomplete output file: {}'.format(exception))
+            return self.exit_codes.ERROR_INCOMPLETE_OUTPUT_FILE
+
+        if storage == 'npz':
+            with tempfile.TemporaryDirectory() as tmpdir:
+                arrays_path = write_ev_arrays(ev_arrays, os.path.join(tmpdir, EV_ARRAYS_FILENAME))
+                self.out('ev_output_arrays', SinglefileData(file=arrays_path))
+        elif output_files:
+            ev_output_file = {}
+            for _, name, key in output_files:
+                with output_folder.open(key, mode='rb') as handle:
+                    ev_output_file[name] = SinglefileData(file=handle, filename=os.path.basename(key))
+            self.out('ev_output_file', ev_output_file)
+        if OUTPUT_ARCHIVE in output_folder.list_object_names():
+            with output_folder.open(OUTPUT_ARCHIVE, mode='rb') as handle:
+                self.out('ev_output_archive', SinglefileData(file=handle, filename=OUTPUT_ARCHIVE))
         self.out('output_parameters', Dict(dict=output_parameters))
 
         return ExitCode(0)
 
+    def _check_outputs(self, output_folder, output_files):
+        """Exit code of a run which did not write all its output files, or None."""
+        # The timings are written last. A run stopped in its node loop, e.g. by its walltime, left a truncated
+        # output file which a restart completes; any other run without timings failed and would fail again.
+        # The summaries are written with the timings, so that a stopped run of the 'summary' retrieval has none.
+        if TIMINGS_FILE not in output_folder.list_object_names():
+            truncated = truncated_outputs(output_folder, output_files)
+            if truncated:
+                self.logger.error('The run was stopped while writing {}'.format(', '.join(truncated)))
+                return self.exit_codes.ERROR_INCOMPLETE_OUTPUT_FILE
+            self.logger.error('The run failed before writing {}'.format(TIMINGS_FILE))
+            return self.exit_codes.ERROR_RUN_FAILED
+
+        # Only the summaries of the output files are retrieved with the 'summary' output retrieval.
+        if not {self.node.process_class.OUTPUT_FOLDER, SUMMARY_FILE}.intersection(output_folder.list_object_names()):
+            return self.exit_codes.ERROR_NO_OUTPUT_FILE
+
+        missing = missing_outputs(output_folder, output_files)
+        if missing:
+            self.logger.error('The run ended without writing {}'.format(', '.join(missing)))
+            return self.exit_codes.ERROR_NO_OUTPUT_FILE
+        return None
+
 
 # EOF
@@ -1,3 +1,5 @@
 """PorousMaterials utils."""
-from .base_parser import parse_base_output
+from .base_parser import parse_base_output, parse_outputs
+from .ev_arrays import load_ev_arrays, write_ev_arrays
 from .input_generator import PorousMaterialsInput
+from .retrieved import MemoryFolder, parse_retrieved
@@ -1,53 +1,429 @@
 """Basic PorousMaterials parser."""
-import pandas as pd
+import re
+from contextlib import contextmanager
+from functools import partial
 
+import numpy as np
 
-def parse_base_output(output_abs_path):
+K_TO_KJ_MOL = 1.0 / 120.273
+
+# Number of lines before the CSV block: banner, density label/value, temperature label/value.
+HEADER_LINES = 5
+# The banner ends with the number of nodes of the file, e.g. `... nodes: 1234`, in the checkpointed templates.
+BANNER = '!!!Generated results using aiida-porousmaterials plugin!!!'
+NODES_MARKER = ' nodes: '
+
+# Numeric columns written by the templates. The optional `adsorbate` column of the
+# multi-component templates is constant per file and never read. The optional
+# `multiplicity` column counts the nodes each row stands for after deduplication.
+EV_COLUMNS = ['Ev_K', 'boltzmann_factor', 'weighted_energy_K', 'Rv_A', 'x', 'y', 'z']
+EV_DTYPES = dict({column: np.float64 for column in EV_COLUMNS}, multiplicity=np.int64)
+
+# Defaults of the screening descriptors, energies in kJ/mol.
+DEFAULT_EV_SETTING = [90, 80, 50]
+DEFAULT_HISTOGRAM_RANGE = [-100.0, 0.0]
+DEFAULT_HISTOGRAM_BINS = 50
+
+
+class IncompleteOutputError(ValueError):
+    """An Ev output file with fewer rows than nodes, left by an interrupted calculation."""
+
+    def __init__(self, rows, num_nodes):
+        super(IncompleteOutputError, self).__init__('{} rows written out of {} nodes'.format(rows, num_nodes))
+        self.rows = rows
+        self.num_nodes = num_nodes
+
+
+def read_header(handle):
+    """
+    Read the density, temperature and number of nodes (None if not in the banner)
+    of the header of an Ev output file and leave the handle positioned at the CSV column names.
+    """
+    lines = [handle.readline() for _ in range(HEADER_LINES)]
+    density = float(lines[2])
+    temperature = float(lines[4])
+    num_nodes = int(lines[0].split(NODES_MARKER)[1]) if NODES_MARKER in lines[0] else None
+    return density, temperature, num_nodes
+
+
+def get_temperatures(parameters):
+    """Temperatures (K) of the parameters, whose `temperature` is either a number or a list of them."""
+    temperature = parameters['temperature']
+    return [float(value) for value in temperature] if isinstance(temperature, list) else [float(temperature)]
+
+
+def temperature_key(temperature):
+    """Key of the results at temperature in output_parameters, e.g. T_298K or T_298_15K."""
+    return 'T_{:g}K'.format(temperature).replace('.', '_')
+
+
+def is_temperature_key(key):
+    """Whether key is a `temperature_key`."""
+    return re.match(r'^T_\d+(_\d+)?K$', key) is not None
+
+
+def format_banner(num_nodes):
+    """Banner line of an Ev output file of num_nodes nodes."""
+    return '{}{}{}\n'.format(BANNER, NODES_MARKER, num_nodes)
+
+
+@contextmanager
+def _open_output(output):
+    """
+    Open output if it is a path or a callable returning a text handle
+    (e.g. `partial(folder.open, key)` of an AiiDA node), otherwise use
+    it as an already open text handle.
+    """
+    if hasattr(output, 'read'):
+        yield output
+    elif callable(output):
+        with output() as handle:
+            yield handle
+    else:
+        with open(output) as handle:
+            yield handle
+
+
+def _nodes_props(chunk, mask, offset):
+    """Properties of the nodes of a chunk selected by mask, as (node indices, rows)."""
+    index = np.flatnonzero(mask)
+    props = np.column_stack([
+        chunk['boltzmann_factor'].values[index],
+        chunk['weighted_energy_K'].values[index] * K_TO_KJ_MOL,
+        chunk['Rv_A'].values[index],
+        chunk['x'].values[index],
+        chunk['y'].values[index],
+        chunk['z'].values[index],
+    ])
+    return (index + offset).tolist(), props.tolist()
+
+
+def _at_temperature(chunk, temperature):
+    """chunk with its Boltzmann factors and weighted energies at temperature, or as written if it is None."""
+    if temperature is None:
+        return chunk
+    boltzmann_factor = np.exp(-chunk['Ev_K'].values / temperature)
+    return chunk.assign(boltzmann_factor=boltzmann_factor, weighted_energy_K=boltzmann_factor * chunk['Ev_K'].values)
+
+
+def _read_csv(handle, **kwargs):
+    """Read the numeric columns of the CSV block of an Ev output file."""
+    # pandas is only imported when parsing, not when loading the calculation or parser plugin.
+    import pandas as pd
+
+    return pd.read_csv(handle, usecols=lambda column: column in EV_DTYPES, dtype=EV_DTYPES, **kwargs)
+
+
+def weighted_percentile(values, weights, percentiles):
+    """
+    Percentiles of values where each value is repeated weights times, identical
+    to `np.percentile(np.repeat(values, weights), percentiles)` without the copies.
+    """
+    order = np.argsort(values, kind='mergesort')
+    values = values[order]
+    cumulative = np.cumsum(weights[order])
+    positions = np.asarray(percentiles, dtype=np.float64) / 100. * (cumulative[-1] - 1)
+    lower = values[np.searchsorted(cumulative, np.floor(positions), side='right')]
+    upper = values[np.searchsorted(cumulative, np.ceil(positions), side='right')]
+    return lower + (upper - lower) * (positions - np.floor(positions))
+
+
+class EnergyHistogram:
+    """Fixed-bin histogram of node energies (kJ/mol), counting the nodes below and above its range."""
+
+    def __init__(self, histogram_range=None, histogram_bins=DEFAULT_HISTOGRAM_BINS):
+        histogram_range = histogram_range or DEFAULT_HISTOGRAM_RANGE
+        self.bin_edges = np.linspace(histogram_range[0], histogram_range[1], histogram_bins + 1)
+        self.counts = np.zeros(histogram_bins, dtype=np.int64)
+        self.below = 0
+        self.above = 0
+
+    def update(self, energies, weights):
+        """Count energies (kJ/mol), each for weights nodes."""
+        self.counts += np.histogram(energies, bins=self.bin_edges, weights=weights)[0].astype(np.int64)
+        self.below += int(weights[energies < self.bin_edges[0]].sum())
+        self.above += int(weights[energies > self.bin_edges[-1]].sum())
+
+
+class EvReduction:
+    """
+    Running reduction over the rows of an Ev output file.
+    Only the node count, the extremes with all their tied nodes, the sums of
+    Boltzmann factors and weighted energies and a fixed-bin energy histogram
+    are kept, so the memory needed does not depend on the number of nodes,
+    whatever the chunks fed to `update`.
+    """
+
+    def __init__(self, histogram_range=None, histogram_bins=DEFAULT_HISTOGRAM_BINS):
+        self.histogram = EnergyHistogram(histogram_range, histogram_bins)
+        self.rows = 0
+        self.count = 0
+        self.minimum = None
+        self.maximum = None
+        self.minimum_nodes = ([], [])
+        self.maximum_nodes = ([], [])
+        self.boltzmann_factor_sum = 0.0
+        self.weighted_energy_sum = 0.0
+        self.percentiles = {}
+        self.arrays = None
+
+    @classmethod
+    def from_summary(cls, summary):
+        """Reduction computed by the templates on the remote side (`summarize` in ev_nodes.jl)."""
+        reduction = cls()
+        # The summary of an empty file has no histogram.
+        if summary['count']:
+            reduction.histogram.bin_edges = np.asarray(summary['bin_edges'], dtype=np.float64)
+            reduction.histogram.counts = np.asarray(summary['counts'], dtype=np.int64)
+            reduction.histogram.below = summary['below']
+            reduction.histogram.above = summary['above']
+        reduction.rows = summary['rows']
+        reduction.count = summary['count']
+        reduction.minimum = summary['minimum']
+        reduction.maximum = summary['maximum']
+        for name in ['minimum_nodes', 'maximum_nodes']:
+            index, rows = summary[name]
+            setattr(reduction, name, (index, [[row[0], row[1] * K_TO_KJ_MOL] + row[2:] for row in rows]))
+        reduction.boltzmann_factor_sum = summary['boltzmann_factor_sum']
+        reduction.weighted_energy_sum = summary['weighted_energy_sum']
+        return reduction
+
+    def update(self, chunk):
+        """
+        Fold a DataFrame of consecutive nodes into the reduction.
+        Rows with a multiplicity count for that many nodes.
+        """
+        energies = chunk['Ev_K'].values
+        if energies.shape[0] == 0:
+            return
+        if 'multiplicity' in chunk:
+            weights = chunk['multiplicity'].values
+        else:
+            weights = np.ones(energies.shape[0], dtype=np.int64)
+        offset = self.rows
+        self.rows += energies.shape[0]
+        self.count += int(weights.sum())
+        self.boltzmann_factor_sum += float((chunk['boltzmann_factor'].values * weights).sum())
+        self.weighted_energy_sum += float((chunk['weighted_energy_K'].values * weights).sum())
+
+        self.histogram.update(energies * K_TO_KJ_MOL, weights)
+
+        minimum = float(energies.min())
+        if self.minimum is None or minimum < self.minimum:
+            self.minimum = minimum
+            self.minimum_nodes = _nodes_props(chunk, energies == minimum, offset)
+        elif minimum == self.minimum:
+            index, props = _nodes_props(chunk, energies == minimum, offset)
+            self.minimum_nodes[0].extend(index)
+            self.minimum_nodes[1].extend(props)
+
+        maximum = float(energies.max())
+        if self.maximum is None or maximum > self.maximum:
+            self.maximum = maximum
+            self.maximum_nodes = _nodes_props(chunk, energies == maximum, offset)
+        elif maximum == self.maximum:
+            index, props = _nodes_props(chunk, energies == maximum, offset)
+            self.maximum_nodes[0].extend(index)
+            self.maximum_nodes[1].extend(props)
+
+    def histogram_percentiles(self, ev_setting):
+        """
+        Energy percentiles (kJ/mol) estimated from the histogram, assuming
+        nodes spread evenly within each bin and between the extremes and the
+        histogram range.
+        """
+        minimum = self.minimum * K_TO_KJ_MOL
+        maximum = self.maximum * K_TO_KJ_MOL
+        histogram = self.histogram
+        energies = np.concatenate([[minimum], np.clip(histogram.bin_edges, minimum, maximum), [maximum]])
+        cumulative = np.concatenate([[0, histogram.below], histogram.below + np.cumsum(histogram.counts), [self.count]])
+        return np.interp(np.asarray(ev_setting, dtype=np.float64) / 100. * self.count, cumulative, energies)
+
+
+def _reduce_whole(handle, reductions, temperatures, ev_setting, keep_arrays):
+    """Fold the whole CSV block into reductions, and return its exact percentiles (kJ/mol)."""
+    df = _read_csv(handle)  # pylint: disable=invalid-name
+    for each, temperature in zip(reductions, temperatures):
+        each.update(_at_temperature(df, temperature))
+    if keep_arrays:
+        reductions[0].arrays = {column: df[column].values for column in df.columns}
+    if df.empty:
+        return np.full(len(ev_setting), np.nan)
+    if 'multiplicity' in df:
+        return weighted_percentile(df['Ev_K'].values, df['multiplicity'].values, ev_setting) * K_TO_KJ_MOL
+    return np.percentile(df['Ev_K'].values, ev_setting) * K_TO_KJ_MOL
+
+
+def _reduce_chunks(  # pylint: disable=too-many-arguments
+    handle, chunksize, reductions, temperatures, ev_setting, keep_arrays
+):
+    """
+    Fold the CSV block into reductions chunksize rows at a time,
+    and return its percentiles (kJ/mol) estimated from the histogram.
+    """
+    chunks = []
+    for chunk in _read_csv(handle, chunksize=chunksize):
+        for each, temperature in zip(reductions, temperatures):
+            each.update(_at_temperature(chunk, temperature))
+        if keep_arrays:
+            chunks.append({column: chunk[column].values for column in chunk.columns})
+    if keep_arrays:
+        reductions[0].arrays = {
+            column: np.concatenate([chunk[column] for chunk in chunks] or [np.empty(0)])
+            for column in (chunks[0] if chunks else EV_COLUMNS)
+        }
+    if not reductions[0].rows:
+        return np.full(len(ev_setting), np.nan)
+    return reductions[0].histogram_percentiles(ev_setting)
+
+
+def read_ev_output(  # pylint: disable=too-many-arguments
+    handle,
+    chunksize=None,
+    ev_setting=None,
+    histogram_range=None,
+    histogram_bins=None,
+    keep_arrays=False,
+    temperatures=None
+):
+    """
+    Reduce the CSV block of an Ev output file, read from handle.
+    With chunksize, the block is streamed chunksize rows at a time and
+    the percentiles are estimated from the histogram, otherwise they are exact.
+    With keep_arrays, the per-node columns are also kept in `reduction.arrays`.
+    With temperatures, the rows are reduced at each of them (None for the
+    temperature of the file) in the same pass, and a list of reductions
+    sharing the percentiles is returned.
+    """
+    temperature_list = [None] if temperatures is None else temperatures
+    reductions = [EvReduction(histogram_range, histogram_bins or DEFAULT_HISTOGRAM_BINS) for _ in temperature_list]
+    ev_setting = DEFAULT_EV_SETTING if ev_setting is None else ev_setting
+    if chunksize is None:
+        percentiles = _reduce_whole(handle, reductions, temperature_list, ev_setting, keep_arrays)
+    else:
+        percentiles = _reduce_chunks(handle, chunksize, reductions, temperature_list, ev_setting, keep_arrays)
+    for each in reductions:
+        each.percentiles = dict(zip([str(value) for value in ev_setting], percentiles.tolist()))
+        each.arrays = reductions[0].arrays
+    return reductions[0] if temperatures is None else reductions
+
+
+def parse_base_output(  # pylint: disable=too-many-arguments
+    output_abs_path,
+    chunksize=None,
+    ev_setting=None,
+    histogram_range=None,
+    histogram_bins=None,
+    with_arrays=False,
+    temperatures=None
+):
     """
     Parse Ev PorousMaterials output file
-    Any change on data (except unit conversion)
-    is avoided here! Those data processing calculations
-    should be done within a workchain and thourgh a
-    calcfunction.
+    Besides unit conversion, only the screening descriptors
+    which need every node (Boltzmann averages, percentiles
+    and histogram) are computed here, in the same pass.
+    Anything else should be done within a workchain
+    and thourgh a calcfunction.
+    output_abs_path may also be an open text handle
+    or a callable opening one.
+    If chunksize is given, the file is streamed in
+    blocks of chunksize nodes to keep the memory flat.
+    Raises IncompleteOutputError if the file has fewer
+    rows than the nodes its banner announces.
+    With with_arrays, the per-node columns are returned
+    as well, as a (results, arrays) tuple.
+    With a list of temperatures, the Boltzmann-weighted
+    results are derived from Ev_K at each of them and
+    returned by `temperature_key`.
+    """
+    with _open_output(output_abs_path) as handle:
+        density, temperature, num_nodes = read_header(handle)
+        reduction = read_ev_output(
+            handle,
+            chunksize=chunksize,
+            ev_setting=ev_setting,
+            histogram_range=histogram_range,
+            histogram_bins=histogram_bins,
+            keep_arrays=with_arrays,
+            temperatures=None if temperatures is None else [None if t == temperature else t for t in temperatures]
+        )
+    reductions = [reduction] if temperatures is None else reduction
+    if num_nodes is not None and reductions[0].rows != num_nodes:
+        raise IncompleteOutputError(reductions[0].rows, num_nodes)
+
+    method = 'exact' if chunksize is None else 'histogram'
+    if temperatures is None:
+        results = ev_results(reduction, density, temperature, method)
+    else:
+        results = {
+            temperature_key(value): ev_results(each, density, value, method)
+            for value, each in zip(temperatures, reductions)
+        }
+    if with_arrays:
+        return results, reductions[0].arrays
+    return results
+
+
+def parse_summary(summary, ev_setting=None, temperatures=None):
+    """
+    Results of an Ev output file from its summary written by the templates,
+    the same as `parse_base_output` of the file gives, with exact percentiles.
+    With temperatures, the results at each of them by `temperature_key`,
+    from the entries of the summary `by_temperature`.
     """
-    K_to_kJ_mol = 1.0 / 120.273  # pylint: disable=invalid-name
+    if temperatures is not None:
+        by_temperature = {entry['temperature']: entry for entry in summary.get('by_temperature', [])}
+        by_temperature[summary['temperature']] = summary
+        missing = [value for value in temperatures if value not in by_temperature]
+        if missing:
+            raise ValueError('The summary has no entry at {} K'.format(', '.join(str(value) for value in missing)))
+        return {
+            temperature_key(value): parse_summary(dict(summary, **by_temperature[value]), ev_setting)
+            for value in temperatures
+        }
+    ev_setting = DEFAULT_EV_SETTING if ev_setting is None else ev_setting
+    reduction = EvReduction.from_summary(summary)
+    percentiles = np.asarray(summary.get('percentiles', []), dtype=np.float64) * K_TO_KJ_MOL
+    reduction.percentiles = dict(zip([str(value) for value in ev_setting], percentiles.tolist()))
+    return ev_results(reduction, summary['density'], summary['temperature'], 'exact')
 
-    with open(output_abs_path) as file:
-        lines = file.readlines()
-        density = float(lines[2])
-        temperature = float(lines[4])
 
-    df = pd.read_csv(output_abs_path, skiprows=5)  # pylint: disable=invalid-name
+def ev_results(reduction, density, temperature, percentiles_method):
+    """
+    Results reported for an Ev output file, from its reduction. A file without nodes,
+    e.g. of a probe which cannot reach any Voronoi node, has NaN extremes and averages,
+    and neither percentiles nor histogram.
+    """
     results = {}
     results['energy_unit'] = 'kJ/mol'
 
-    total_num_nodes = df.shape[0]
-    minimum = df.Ev_K.min()
-    maximum = df.Ev_K.max()
-    df_min = df.loc[df.Ev_K == minimum]
-    df_max = df.loc[df.Ev_K == maximum]
+    empty = reduction.count == 0
+    results['Ev_minimum'] = np.nan if empty else reduction.minimum * K_TO_KJ_MOL
+    results['Ev_maximum'] = np.nan if empty else reduction.maximum * K_TO_KJ_MOL
 
-    results['Ev_minimum'] = minimum * K_to_kJ_mol
-    results['Ev_maximum'] = maximum * K_to_kJ_mol
-
-    # We may have several nodes with minim or maximum energy, so! More Code!
-    results['minimum_nodes_props'] = {}
-    results['maximum_nodes_props'] = {}
+    # We may have several nodes with minimum or maximum energy.
+    results['minimum_nodes_props'] = {'node_' + str(i): row for i, row in zip(*reduction.minimum_nodes)}
+    results['maximum_nodes_props'] = {'node_' + str(i): row for i, row in zip(*reduction.maximum_nodes)}
     results['header_nodes_props'] = ['Boltzmann_factor', 'Weighted_energy', 'radius', 'x', 'y', 'z']
 
-    for index, row in df_min.iterrows():
-        minimum_node_properties = []
-        minimum_node_properties = [
-            row.boltzmann_factor, row.weighted_energy_K * K_to_kJ_mol, row.Rv_A, row.x, row.y, row.z
-        ]
-        results['minimum_nodes_props']['node_' + str(index)] = minimum_node_properties
+    results['boltzmann_factor_sum'] = reduction.boltzmann_factor_sum
+    results['weighted_energy_sum'] = reduction.weighted_energy_sum * K_TO_KJ_MOL
 
-    for index, row in df_max.iterrows():
-        maximum_node_properties = []
-        maximum_node_properties = [
-            row.boltzmann_factor, row.weighted_energy_K * K_to_kJ_mol, row.Rv_A, row.x, row.y, row.z
-        ]
-        results['maximum_nodes_props']['node_' + str(index)] = maximum_node_properties
+    # Boltzmann factors sum to the partition sum; its average over nodes is the Henry-like descriptor.
+    if empty:
+        results['Ev_boltzmann_average'] = np.nan
+        results['average_boltzmann_factor'] = np.nan
+    else:
+        results['Ev_boltzmann_average'] = results['weighted_energy_sum'] / reduction.boltzmann_factor_sum
+        results['average_boltzmann_factor'] = reduction.boltzmann_factor_sum / reduction.count
+        results['Ev_percentiles'] = reduction.percentiles
+        results['Ev_percentiles_method'] = percentiles_method
+        results['Ev_histogram'] = {
+            'bin_edges': reduction.histogram.bin_edges.tolist(),
+            'counts': reduction.histogram.counts.tolist(),
+            'below_range': reduction.histogram.below,
+            'above_range': reduction.histogram.above,
+        }
 
     results['coordinate_system'] = 'Cartesian'
     results['framework_density'] = density
@@ -55,9 +431,31 @@ def parse_base_output(output_abs_path):
     results['temperature'] = temperature
     results['temperature_unit'] = 'Kelvin'
     results['radius_unit'] = 'Angstrom'
-    results['total_number_of_accessible_Voronoi_nodes'] = total_num_nodes
-
+    results['total_number_of_accessible_Voronoi_nodes'] = reduction.count
+    if reduction.rows != reduction.count:
+        results['number_of_evaluated_Voronoi_nodes'] = reduction.rows
     return results
 
 
+# Executors of `concurrent.futures` by pool, imported only when parsing concurrently.
+POOL_EXECUTORS = {'thread': 'ThreadPoolExecutor', 'process': 'ProcessPoolExecutor'}
+
+
+def parse_outputs(output_abs_paths, workers=1, pool='thread', **kwargs):
+    """
+    Parse several Ev output files, given by path or by a callable opening them,
+    and return their results in the same order.
+    With more than one worker, the files are parsed concurrently in a pool of
+    threads (pandas releases the GIL while tokenizing) or of processes.
+    The keyword arguments are passed on to `parse_base_output`.
+    """
+    parse = partial(parse_base_output, **kwargs)
+    if workers <= 1 or len(output_abs_paths) <= 1:
+        return [parse(path) for path in output_abs_paths]
+    from concurrent import futures
+
+    with getattr(futures, POOL_EXECUTORS[pool])(max_workers=min(workers, len(output_abs_paths))) as executor:
+        return list(executor.map(parse, output_abs_paths))
+
+
 # EOF
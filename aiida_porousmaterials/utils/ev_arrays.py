@@ -0,0 +1,71 @@
+"""Compact binary storage of the per-node Ev results."""
+import os
+import tempfile
+
+import numpy as np
+
+EV_ARRAYS_FILENAME = 'ev_output_arrays.npz'
+
+
+def _flatten(arrays, prefix=''):
+    """{adsorbate: {probe: {column: array}}} to {'adsorbate/probe/column': array}, at any depth."""
+    flat = {}
+    for key, value in arrays.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, prefix + key + '/'))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def _nest(flat):
+    """Inverse of `_flatten`."""
+    arrays = {}
+    for key, array in flat.items():
+        level = arrays
+        *parents, column = key.split('/')
+        for parent in parents:
+            level = level.setdefault(parent, {})
+        level[column] = array
+    return arrays
+
+
+def write_ev_arrays(arrays, path):
+    """
+    Write the per-node columns of all output files to a single compressed npz file.
+    arrays follows the layout of `output_parameters`: {adsorbate: {probe: {column: array}}},
+    with an extra framework level in batch mode.
+    """
+    np.savez_compressed(path, **_flatten(arrays))
+    return path
+
+
+def load_ev_arrays(node, cache_dir=None):
+    """
+    Load the `ev_output_arrays` SinglefileData of a calculation as memory-mapped arrays,
+    in the layout of `output_parameters`, e.g. {adsorbate: {probe: {column: array}}}.
+    The npz archive is decompressed once into cache_dir (a folder named after
+    the node UUID in the temporary directory by default) and reused afterwards.
+    """
+    cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), 'aiida_porousmaterials', node.uuid)
+    # Written last, so that an interrupted extraction is redone.
+    index_path = os.path.join(cache_dir, 'keys.txt')
+
+    if not os.path.exists(index_path):
+        with node.open(mode='rb') as handle:
+            with np.load(handle) as npz:
+                for key in npz.files:
+                    path = os.path.join(cache_dir, key + '.npy')
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    np.save(path, npz[key])
+                keys = npz.files
+        with open(index_path, 'w') as handle:
+            handle.write('\n'.join(keys))
+
+    with open(index_path) as handle:
+        keys = handle.read().split()
+
+    return _nest({key: np.load(os.path.join(cache_dir, key + '.npy'), mmap_mode='r') for key in keys})
+
+
+# EOF
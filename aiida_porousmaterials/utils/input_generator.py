@@ -1,7 +1,89 @@
 """Basic PorousMaterials input generator."""
+import json
 import os
 from string import Template
-from copy import deepcopy
+from functools import lru_cache
+
+# Number of energy grid points along each cell vector in the 'grid' energy mode.
+DEFAULT_GRID_POINTS = 50
+TEMPLATES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+# Writing of the timings and summaries of the run, once after the last template of an input.
+EPILOGUE = '\nwrite_timings()\nwrite_summaries()\n'
+
+
+def julia_list(names):
+    """Julia literal of a list of strings, e.g. ["Xe","Kr"] as used for `adsorbates`."""
+    return '[{}]'.format(','.join('"{}"'.format(name) for name in names))
+
+
+# Templates evaluating a plan of (probe, node file, adsorbates), and whether it includes the probes which are
+# adsorbates (evaluated with that adsorbate) and the other probes, e.g. PLD (evaluated with pld_adsorbates).
+PLAN_TEMPLATES = {
+    'ev_vdw_kh_multicomp_template': (True, False),
+    'ev_vdw_kh_pld_template': (False, True),
+    'ev_vdw_kh_multicomp_pld_template': (True, True),
+}
+
+
+def plan_entries(node_names, frameworkname, adsorbates, other_adsorbates, probes=(True, True), reused_pairs=()):
+    """
+    (probe, node file, adsorbates) evaluated on the node files node_names (the keys of `acc_voronoi_nodes`,
+    <frameworkname>_<probe>) of the framework: the nodes of a probe which is one of adsorbates are evaluated
+    with that adsorbate, the others with other_adsorbates. probes selects either kind, see PLAN_TEMPLATES.
+    The adsorbate probes come first, in the order of adsorbates. The (probe, adsorbate) pairs of reused_pairs,
+    taken over from a previous calculation, are left out, and so are the entries left without adsorbates.
+    """
+    prefix = frameworkname + '_'
+    names = {name[len(prefix):]: name for name in node_names if name.startswith(prefix)}
+    entries = []
+    if probes[0]:
+        entries += [(probe, names[probe], [probe]) for probe in adsorbates if probe in names]
+    if probes[1] and other_adsorbates:
+        entries += [(probe, names[probe], list(other_adsorbates)) for probe in sorted(names) if probe not in adsorbates]
+    reused_pairs = {tuple(pair) for pair in reused_pairs}
+    entries = [(probe, name, [adsorbate for adsorbate in evaluated if (probe, adsorbate) not in reused_pairs])
+               for probe, name, evaluated in entries]
+    return [entry for entry in entries if entry[2]]
+
+
+def julia_plan(entries):
+    """Julia literal of the plan_entries evaluated by `evaluate_plan` of the templates."""
+    return '[{}]'.format(', '.join(
+        '("{}", "{}.voro_accessible", {})'.format(probe, name, julia_list(adsorbates))
+        for probe, name, adsorbates in entries
+    ))
+
+
+def summary_setting(ev_setting, bin_edges, temperatures):
+    """
+    Julia literal of the percentiles, histogram bin edges and temperatures
+    of the summaries written by the templates.
+    """
+    return '(ev_setting=[{}], bin_edges=[{}], temperatures=[{}])'.format(
+        ', '.join(repr(float(value)) for value in ev_setting), ', '.join(repr(float(edge)) for edge in bin_edges),
+        ', '.join(repr(float(value)) for value in temperatures)
+    )
+
+
+@lru_cache(maxsize=None)
+def read_template(name):
+    """Content of templates/<name>.jl, read once per process."""
+    with open(os.path.join(TEMPLATES_PATH, name + '.jl')) as handle:
+        return handle.read()
+
+
+@lru_cache(maxsize=None)
+def load_template(name):
+    """
+    The parsed template templates/<name>.jl and the set of its placeholders,
+    cached for the lifetime of the process.
+    """
+    template = Template(read_template(name))
+    placeholders = set()
+    for match in Template.pattern.finditer(template.template):
+        placeholders.add(match.group('named') or match.group('braced'))
+    placeholders.discard(None)
+    return template, frozenset(placeholders)
 
 
 class PorousMaterialsInput:
@@ -14,25 +96,107 @@ class PorousMaterialsInput:
     """
 
     def __init__(self, params):
-        self.params = deepcopy(params)
+        self.params = dict(params)
+        # Folder the templates write their results to, relative to the working directory.
+        self.params.setdefault('output_dir', 'Output')
+        # How the node loop is split: 'serial', 'threads' or 'distributed'.
+        self.params.setdefault('parallel', 'serial')
+        # How the node energies are obtained: 'direct' evaluation or 'grid' interpolation.
+        self.params.setdefault('energy_mode', 'direct')
+        self.params.setdefault('grid_points', DEFAULT_GRID_POINTS)
+        # Energies do not depend on the temperature: with several temperatures, the output files are
+        # written at the first one and the parser derives the others from their Ev_K column.
+        if isinstance(self.params.get('temperature', None), list):
+            self.params['temperature'] = self.params['temperature'][0]
+        # Julia NamedTuple of the remote summary settings, see `summary_setting`, or nothing.
+        self.params.setdefault('summary_setting', 'nothing')
+        # Adsorbates evaluated on the PLD probe nodes, all of them unless only some are missing.
+        if 'adsorbates' in self.params:
+            self.params.setdefault('pld_adsorbates', self.params['adsorbates'])
+        # (probe, node file, adsorbates) evaluated by the multi-component and PLD templates.
+        self.entries = None
+        if 'plan' not in self.params and self.params.get('input_template', None) in PLAN_TEMPLATES:
+            self._set_plan()
 
-    def render(self):
+    def _set_plan(self):
         """
-        Performing the described tasks.
+        Set the plan of the template from the node_names of the Voronoi node files if given, otherwise
+        from the <frameworkname>_<adsorbate> and <frameworkname>_PLD ones, without the reused_pairs.
+        It is left unset without adsorbates or frameworkname, which `missing_parameters` reports.
         """
+        if 'adsorbates' not in self.params or 'frameworkname' not in self.params:
+            return
+        frameworkname = self.params['frameworkname']
+        adsorbates = json.loads(self.params['adsorbates'])
+        default_names = ['{}_{}'.format(frameworkname, name) for name in adsorbates + ['PLD']]
+        node_names = self.params.get('node_names', default_names)
+        self.entries = plan_entries(
+            node_names, frameworkname, adsorbates, json.loads(self.params['pld_adsorbates']),
+            PLAN_TEMPLATES[self.params['input_template']], self.params.get('reused_pairs', ())
+        )
+        self.params['plan'] = julia_plan(self.entries)
 
-        output = '### Generated by AiiDA ###'
-        output += ''
-        params = deepcopy(self.params)
+    def missing_parameters(self):
+        """Sorted placeholders of the template which are not set by the parameters."""
+        if 'input_template' not in self.params:
+            return ['input_template']
+        _, placeholders = load_template(self.params['input_template'])
+        missing = placeholders.difference(self.params)
+        # The plan is generated from these, see `_set_plan`.
+        if 'plan' in missing:
+            missing = missing.difference(['plan']).union({'adsorbates', 'frameworkname'}.difference(self.params))
+        return sorted(missing)
+
+    def missing_node_files(self):
+        """
+        Sorted names of the <frameworkname>_<adsorbate> node files of the adsorbate probes of the plan
+        which are not in node_names, leaving out those whose pair is reused.
+        """
+        node_names = self.params.get('node_names', None)
+        if self.entries is None or node_names is None or not PLAN_TEMPLATES[self.params['input_template']][0]:
+            return []
+        reused_pairs = {tuple(pair) for pair in self.params.get('reused_pairs', ())}
+        names = [
+            '{}_{}'.format(self.params['frameworkname'], adsorbate)
+            for adsorbate in json.loads(self.params['adsorbates'])
+            if (adsorbate, adsorbate) not in reused_pairs
+        ]
+        return sorted(name for name in names if name not in node_names)
+
+    def output_files(self):
+        """
+        Paths of the Ev output files the rendered input writes, relative to the working directory,
+        or None if they are not known (e.g. a plan given as parameter).
+        """
+        output_dir = self.params['output_dir']
+        if self.entries is not None:
+            return [
+                '{}/Ev_vdw_{}_{}_{}.csv'.format(output_dir, self.params['frameworkname'], probe, adsorbate)
+                for probe, _, adsorbates in self.entries for adsorbate in adsorbates
+            ]
+        if 'plan' not in self.params and 'output_filename' in self.params:
+            return ['{}/{}'.format(output_dir, self.params['output_filename'])]
+        return None
 
-        basepath = os.path.dirname(os.path.abspath(__file__))
-        tmppath = '{}/templates/{}.jl'.format(basepath, self.params['input_template'])
+    def render(self, preamble=True, epilogue=True):
+        """
+        Performing the described tasks.
+        The Julia functions shared by the templates are
+        prepended, unless preamble is False (e.g. for all
+        but the first framework of a batch), and the
+        timings and summaries are written at the end,
+        unless epilogue is False (e.g. for all but the
+        last framework of a batch).
+        """
 
-        with open(tmppath) as template:
-            lines = template.read()
+        output = '### Generated by AiiDA ###'
+        if preamble:
+            output += read_template('common/ev_nodes')
 
-        inp = Template(lines).substitute(params)
-        output += inp
+        template, _ = load_template(self.params['input_template'])
+        output += template.substitute(self.params)
+        if epilogue:
+            output += EPILOGUE
         return output
 
 
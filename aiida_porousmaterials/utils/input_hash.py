@@ -0,0 +1,88 @@
+"""Canonical hash of the physically relevant inputs of a PorousMaterials calculation."""
+import hashlib
+import json
+
+# Parameters which do not change the computed energies: paths on the remote machine and parallelism.
+# The data_path files are hashed by content instead, as the digest of the `data` folder.
+HASH_EXCLUDED_PARAMETERS = ('data_path', 'parallel')
+# Settings which only change how the code is run or the outputs are parsed, not what is reported.
+HASH_EXCLUDED_SETTINGS = ('cmdline', 'parser_workers', 'parser_pool', 'sysimage', 'staging', 'shared_data_root')
+ADSORBATE_PARAMETERS = ('adsorbate', 'adsorbates')
+# Prefix of the names of the Ev output files of the multi-component templates, Ev_vdw_<framework>_<probe>_<adsorbate>.
+OUTPUT_PREFIX = 'Ev_vdw_'
+
+
+def file_digest(handle, blocksize=2**20):
+    """SHA-256 of the content of a binary file handle."""
+    digest = hashlib.sha256()
+    for block in iter(lambda: handle.read(blocksize), b''):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+def _normalize(value):
+    """Numbers as floats, so that 298 and 298.0 hash alike, recursively."""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def get_adsorbates(parameters):
+    """Adsorbates of the parameters, either the single `adsorbate` or the Julia list `adsorbates`."""
+    if 'adsorbates' in parameters:
+        return json.loads(parameters['adsorbates'])
+    return [parameters['adsorbate']] if 'adsorbate' in parameters else []
+
+
+def input_hash(  # pylint: disable=too-many-arguments
+    structures, acc_voronoi_nodes, parameters, settings=None, with_adsorbates=True, data=None
+):
+    """
+    Hash of the inputs, given the digests of the structure and Voronoi node files by namespace name
+    and the digest of the `data` folder, if any. Paths and parallelism are left out, and so are the
+    adsorbates if with_adsorbates is False, with the <framework>_<adsorbate> node files of their probes,
+    which identifies the calculations differing only by their adsorbates (see `matching_outputs`).
+    """
+    excluded = HASH_EXCLUDED_PARAMETERS if with_adsorbates else HASH_EXCLUDED_PARAMETERS + ADSORBATE_PARAMETERS
+    if not with_adsorbates:
+        probes = {'{}_{}'.format(name, adsorbate) for name in structures for adsorbate in get_adsorbates(parameters)}
+        acc_voronoi_nodes = {name: digest for name, digest in acc_voronoi_nodes.items() if name not in probes}
+    payload = {
+        'structure': structures,
+        'acc_voronoi_nodes': acc_voronoi_nodes,
+        'parameters': _normalize({key: value for key, value in parameters.items() if key not in excluded}),
+        'settings': _normalize({
+            key: value for key, value in (settings or {}).items() if key not in HASH_EXCLUDED_SETTINGS
+        }),
+    }
+    if data is not None:
+        payload['data'] = data
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf8')).hexdigest()
+
+
+def output_node_file(name):
+    """Name of the Voronoi node file of the Ev output file name, e.g. HKUST1_Xe of Ev_vdw_HKUST1_Xe_Kr."""
+    return name[len(OUTPUT_PREFIX):].rsplit('_', 1)[0]
+
+
+def matching_outputs(names, digests, previous_digests):
+    """
+    Names of the Ev output files of a calculation with the same base hash which were computed on
+    Voronoi node files with the same digests, by name, as in digests: previous_digests maps the
+    node files of that calculation to their digests. The base hash leaves out the node files of
+    the adsorbate probes, which are compared here for each output file.
+    """
+    return [
+        name for name in names
+        if previous_digests.get(output_node_file(name)) is not None and
+        previous_digests.get(output_node_file(name)) == digests.get(output_node_file(name))
+    ]
+
+
+# EOF
@@ -0,0 +1,233 @@
+"""Parsing the retrieved files of a PorousMaterials calculation through file handles only."""
+import io
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from functools import partial
+
+from .base_parser import get_temperatures, parse_base_output, parse_outputs, parse_summary, read_header
+from .input_generator import DEFAULT_GRID_POINTS
+
+OUTPUT_FOLDER = 'Output'
+NODE_FILTER_FILE = 'node_filter.json'
+TIMINGS_FILE = 'timings.json'
+SUMMARY_FILE = 'summary.json'
+OUTPUT_ARCHIVE = 'Output.tar.gz'
+# Paths of the Ev output files the input of a calculation writes, listed by the calculation.
+OUTPUTS_FILE = 'outputs.json'
+
+
+class MemoryFolder:
+    """
+    In-memory stand-in for a retrieved FolderData, providing the same
+    `list_object_names` and `open`, to benchmark and test the parsing
+    without a profile. files maps '/' separated keys to their content.
+    """
+
+    def __init__(self, files):
+        self.files = {key: content.encode('utf8') if isinstance(content, str) else content
+                      for key, content in files.items()}
+
+    def list_object_names(self, key=None):
+        """Names of the objects directly under key, or at the top level."""
+        prefix = key.rstrip('/') + '/' if key else ''
+        return sorted({name[len(prefix):].split('/')[0] for name in self.files if name.startswith(prefix)})
+
+    def open(self, key, mode='r'):
+        """Handle of the object key, binary if mode contains 'b'."""
+        content = self.files[key]
+        return io.BytesIO(content) if 'b' in mode else io.StringIO(content.decode('utf8'))
+
+
+def set_nested(dictionary, keys, value):
+    """Set dictionary[keys[0]][keys[1]]... to value, creating the intermediate levels."""
+    for key in keys[:-1]:
+        dictionary = dictionary.setdefault(key, {})
+    dictionary[keys[-1]] = value
+
+
+def storable(value):
+    """value with its NaN and infinite numbers, which AiiDA cannot store, replaced by None."""
+    if isinstance(value, dict):
+        return {key: storable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [storable(item) for item in value]
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def list_output_files(folder, batch=False, output_folder=OUTPUT_FOLDER):
+    """
+    (keys, name, key) of the Ev output files of folder. In batch mode every framework
+    writes to its own subfolder, whose name is then the first of keys.
+    """
+    if output_folder not in folder.list_object_names():
+        return []
+    output_files = []
+    for fname in folder.list_object_names(output_folder):
+        if not batch:
+            output_files.append(([], fname[:-4], '/'.join([output_folder, fname])))
+            continue
+        for subname in folder.list_object_names('/'.join([output_folder, fname])):
+            output_files.append(([fname], subname[:-4], '/'.join([output_folder, fname, subname])))
+    return output_files
+
+
+def missing_outputs(folder, output_files):
+    """
+    Paths of the output files listed in OUTPUTS_FILE of folder which are neither in output_files
+    (see `list_output_files`) nor summarized, e.g. of the frameworks of a batch after a run was stopped.
+    """
+    names = folder.list_object_names()
+    if OUTPUTS_FILE not in names:
+        return []
+    with folder.open(OUTPUTS_FILE, mode='r') as handle:
+        expected = json.load(handle)
+    found = {key for _, _, key in output_files}
+    if SUMMARY_FILE in names:
+        with folder.open(SUMMARY_FILE, mode='r') as handle:
+            found.update(json.load(handle))
+    return sorted(set(expected).difference(found))
+
+
+def truncated_outputs(folder, output_files):
+    """
+    Keys of the output files (see `list_output_files`) of folder with fewer rows than the nodes
+    their banner announces, or not even a whole header, as left by a run stopped in its node loop.
+    """
+    truncated = []
+    for _, _, key in output_files:
+        with folder.open(key, mode='r') as handle:
+            try:
+                _, _, num_nodes = read_header(handle)
+            except (IndexError, ValueError):
+                truncated.append(key)
+                continue
+            handle.readline()
+            rows = sum(1 for line in handle if line.strip())
+        if num_nodes is not None and rows < num_nodes:
+            truncated.append(key)
+    return truncated
+
+
+@contextmanager
+def _openers(folder, keys, pool):
+    """
+    Callables opening the objects keys of folder. Repository nodes do not go to other processes,
+    so with the 'process' pool the objects are streamed to a temporary directory instead, and
+    the paths of the copies are given, which the workers read in chunks as well.
+    """
+    if pool != 'process':
+        yield [partial(folder.open, key, mode='r') for key in keys]
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for index, key in enumerate(keys):
+            paths.append(os.path.join(directory, '{}.csv'.format(index)))
+            with folder.open(key, mode='rb') as source, open(paths[-1], 'wb') as target:
+                shutil.copyfileobj(source, target)
+        yield paths
+
+
+def _parse_options(parameters, settings):
+    """Keyword arguments of `parse_base_output` for the given parameters and settings dictionaries."""
+    return {
+        # Number of Voronoi nodes read at once, by default the whole file is loaded.
+        'chunksize': settings.get('parser_chunksize', None),
+        'ev_setting': parameters.get('ev_setting', None),
+        'histogram_range': settings.get('histogram_range', None),
+        'histogram_bins': settings.get('histogram_bins', None),
+        'with_arrays': settings.get('output_storage', 'csv') == 'npz',
+        'temperatures': get_temperatures(parameters) if isinstance(parameters.get('temperature', None), list) else None,
+    }
+
+
+def _parse_folder(folder, output_files, settings, parse_options):
+    """
+    (keys, name, result) of the output files of folder, and of those only summarized
+    on the remote side when just their summaries were retrieved.
+    """
+    pool = settings.get('parser_pool', 'thread')
+    with _openers(folder, [key for _, _, key in output_files], pool) as openers:
+        results = parse_outputs(openers, workers=settings.get('parser_workers', 1), pool=pool, **parse_options)
+    parsed = [(keys, name, result) for (keys, name, _), result in zip(output_files, results)]
+
+    # Output files reduced on the remote side, by path.
+    if SUMMARY_FILE in folder.list_object_names():
+        with folder.open(SUMMARY_FILE, mode='r') as handle:
+            for path, summary in sorted(json.load(handle).items()):
+                parts = path.split('/')
+                result = parse_summary(summary, parse_options['ev_setting'], parse_options['temperatures'])
+                parsed.append((parts[1:-1], parts[-1][:-4], result))
+    return parsed
+
+
+def _nest_results(parsed, parameters, parse_options):
+    """
+    Output parameters and per-node arrays of the (keys, name, result) of parsed, nested by
+    keys, adsorbate and probe, and first by `temperature_key` with a list of temperatures.
+    """
+    # How the energies were obtained, previous outputs share it as they have the same physical inputs.
+    energy_mode = {'energy_mode': parameters.get('energy_mode', 'direct')}
+    if energy_mode['energy_mode'] == 'grid':
+        energy_mode['grid_points'] = parameters.get('grid_points', DEFAULT_GRID_POINTS)
+
+    output_parameters = {}
+    ev_arrays = {}
+    for keys, name, result in parsed:
+        keys = keys + [name.split('_')[-1], name.split('_')[-2] + '_probe']
+        if parse_options['with_arrays']:
+            result, arrays = result
+            set_nested(ev_arrays, keys, arrays)
+        # Results by temperature key with several temperatures.
+        if parse_options['temperatures'] is None:
+            by_temperature = [([], result)]
+        else:
+            by_temperature = [([key], value) for key, value in result.items()]
+        for prefix, value in by_temperature:
+            value.update(energy_mode)
+            set_nested(output_parameters, prefix + keys, value)
+    return output_parameters, ev_arrays
+
+
+def parse_retrieved(folder, parameters, settings, previous=None, output_files=None):
+    """
+    Parse the retrieved folder (a FolderData or a MemoryFolder) of a calculation with the given
+    parameters and settings dictionaries. previous maps the names of the output files taken over
+    from previous calculations to callables opening them. Output files only summarized on the
+    remote side are read from their summaries. Returns the output parameters and, with the
+    'npz' output storage, the per-node arrays, nested in the same way. With a list of temperatures,
+    the results are nested under a `temperature_key` level first. The timings written by the
+    templates and the parsing time go to `timings`. NaN results are stored as None.
+    """
+    start = time.time()
+    output_files = list_output_files(folder, parameters.get('batch', False)) if output_files is None else output_files
+    parse_options = _parse_options(parameters, settings)
+    parsed = _parse_folder(folder, output_files, settings, parse_options)
+
+    # Pairs taken over from a previous calculation go first, so that new results take precedence.
+    previous = [([], name, parse_base_output(opener, **parse_options)) for name, opener in (previous or {}).items()]
+    output_parameters, ev_arrays = _nest_results(previous + parsed, parameters, parse_options)
+
+    # Voronoi nodes skipped by the radius filters of the calculation, by node file.
+    if NODE_FILTER_FILE in folder.list_object_names():
+        with folder.open(NODE_FILTER_FILE, mode='r') as handle:
+            output_parameters['Voronoi_nodes_filter'] = json.load(handle)
+
+    timings = {}
+    if TIMINGS_FILE in folder.list_object_names():
+        with folder.open(TIMINGS_FILE, mode='r') as handle:
+            timings = json.load(handle)
+    timings['parse_s'] = time.time() - start
+    output_parameters['timings'] = timings
+
+    # e.g. the extremes of the output files without nodes
+    return storable(output_parameters), ev_arrays
+
+
+# EOF
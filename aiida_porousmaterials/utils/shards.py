@@ -0,0 +1,106 @@
+"""Cost estimate of a calculation, splitting of its Voronoi nodes into shards and merging of their outputs."""
+import json
+import shutil
+
+import numpy as np
+
+from .base_parser import HEADER_LINES, NODES_MARKER, format_banner
+
+# Defaults of the `sizing` of PorousMaterialsShardedWorkChain, times in seconds.
+DEFAULT_SIZING = {
+    # Energy loop time per (node, framework atom) pair, e.g. from `pair_seconds` of a previous run.
+    'seconds_per_pair': 1.0e-8,
+    # Loading of PorousMaterials and JIT compilation, see `startup_s` of the timings.
+    'startup_seconds': 120,
+    'safety_factor': 2.0,
+    'min_wallclock_seconds': 600,
+    'max_wallclock_seconds': 86400,
+    'max_shards': 16,
+}
+
+
+def replication_factors(cell, cutoff):
+    """
+    Replications of the unit cell (lattice vectors as rows) along each vector such that
+    the supercell is wider than twice the cutoff, as `replication_factors` of PorousMaterials.
+    """
+    cell = np.asarray(cell, dtype=np.float64)
+    volume = abs(np.linalg.det(cell))
+    widths = [volume / np.linalg.norm(np.cross(cell[(i + 1) % 3], cell[(i + 2) % 3])) for i in range(3)]
+    return [int(np.ceil(2 * cutoff / width - 1e-10)) for width in widths]
+
+
+def count_nodes(handle):
+    """Number of nodes of a `.voro_accessible` file, from its first line."""
+    return int(handle.readline())
+
+
+def estimate_seconds(evaluations, sizing):
+    """
+    Energy loop time of a calculation, without the startup, given its evaluations
+    as (number of nodes, framework atoms after replication, number of probes) triples.
+    """
+    pairs = sum(nodes * atoms * probes for nodes, atoms, probes in evaluations)
+    return pairs * sizing['seconds_per_pair']
+
+
+def pair_seconds(timings):
+    """Measured energy loop time per (node, framework atom) pair, from the `timings` of a calculation."""
+    seconds = 0.0
+    pairs = 0
+    for framework in timings.get('frameworks', {}).values():
+        for pair in framework['pairs'].values():
+            seconds += pair['energy_s']
+            pairs += pair['nodes'] * framework['atoms']
+    return seconds / pairs if pairs else None
+
+
+def plan_shards(loop_seconds, procs, sizing):
+    """
+    Number of shards and walltime of each so that the energy loop of loop_seconds,
+    spread over procs processes, fits max_wallclock_seconds with the safety factor.
+    """
+    budget = sizing['max_wallclock_seconds'] - sizing['startup_seconds']
+    needed = sizing['safety_factor'] * loop_seconds / procs
+    shards = max(1, int(min(sizing['max_shards'], np.ceil(needed / budget)))) if budget > 0 else 1
+    walltime = sizing['startup_seconds'] + needed / shards
+    return shards, int(np.clip(np.ceil(walltime), sizing['min_wallclock_seconds'], sizing['max_wallclock_seconds']))
+
+
+def split_nodes(handle, shards):
+    """
+    Split a `.voro_accessible` file read from handle into shards files of consecutive nodes,
+    returned as text. The node lines are kept as they are, so that the shards together
+    hold exactly the nodes of the file, in the same order.
+    """
+    num_nodes = count_nodes(handle)
+    comment = handle.readline()
+    lines = [handle.readline() for _ in range(num_nodes)]
+    bounds = np.linspace(0, num_nodes, shards + 1).round().astype(int)
+    return [
+        '{}\n{}'.format(stop - start, comment) + ''.join(lines[start:stop])
+        for start, stop in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+def merge_ev_outputs(handles, target):
+    """
+    Write to target the Ev output file of all the nodes from the output files of the shards,
+    opened in handles in the order of the shards: the header and column names of the first,
+    with the total number of nodes in the banner, followed by the rows of all of them.
+    """
+    headers = [[handle.readline() for _ in range(HEADER_LINES + 1)] for handle in handles]
+    if all(NODES_MARKER in header[0] for header in headers):
+        num_nodes = sum(int(header[0].split(NODES_MARKER)[1]) for header in headers)
+        headers[0][0] = format_banner(num_nodes)
+    target.writelines(headers[0])
+    for handle in handles:
+        shutil.copyfileobj(handle, target)
+
+
+def merge_timings(handles):
+    """Timings of the shards, read from handles, as {'shards': [timings]}."""
+    return {'shards': [json.load(handle) for handle in handles]}
+
+
+# EOF
@@ -0,0 +1,45 @@
+"""Staging the input files of a calculation as a single compressed archive."""
+import io
+import tarfile
+from functools import partial
+
+INPUTS_ARCHIVE = 'inputs.tar.gz'
+DATA_ARCHIVE = 'porousmaterials_data.tar.gz'
+
+
+def write_archive(path, members):
+    """
+    Write the gzipped tar archive path of members, (name in the archive, callable opening the
+    content as a seekable binary handle) pairs. The contents are streamed, never held in memory.
+    """
+    with tarfile.open(path, 'w:gz') as archive:
+        for name, opener in members:
+            with opener() as handle:
+                info = tarfile.TarInfo(name)
+                info.size = handle.seek(0, io.SEEK_END)
+                info.mode = 0o644
+                handle.seek(0)
+                archive.addfile(info, handle)
+    return path
+
+
+def file_opener(path):
+    """Callable opening the file path for `write_archive`."""
+    return partial(open, path, 'rb')
+
+
+def unpack_command(archive):
+    """Shell command unpacking archive to the working directory and removing it."""
+    return 'tar xzf {0} && rm {0}'.format(archive)
+
+
+def unpack_shared_command(archive, target):
+    """
+    Shell command unpacking archive to the shared directory target unless it exists already,
+    through a temporary directory so that concurrent jobs never see a partial copy.
+    """
+    unpack = 'mkdir -p {1}.$$ && tar xzf {0} -C {1}.$$ && (mv -T {1}.$$ {1} || rm -rf {1}.$$)'.format(archive, target)
+    return '[ -d {} ] || {{ {}; }}'.format(target, unpack)
+
+
+# EOF
@@ -0,0 +1,101 @@
+"""Building a Julia sysimage with PorousMaterials and its dependencies precompiled."""
+import os
+import subprocess
+import tempfile
+
+from .input_generator import PorousMaterialsInput, julia_list, summary_setting
+
+# A single carbon atom in a cubic P1 cell, enough to exercise every code path of the templates.
+WARMUP_CIF = """data_warmup
+_symmetry_space_group_name_H-M 'P 1'
+_cell_length_a 12.0
+_cell_length_b 12.0
+_cell_length_c 12.0
+_cell_angle_alpha 90.0
+_cell_angle_beta 90.0
+_cell_angle_gamma 90.0
+loop_
+_symmetry_equiv_pos_as_xyz
+'x, y, z'
+loop_
+_atom_site_label
+_atom_site_type_symbol
+_atom_site_fract_x
+_atom_site_fract_y
+_atom_site_fract_z
+_atom_site_charge
+C1 C 0.0 0.0 0.0 0.0
+"""
+
+WARMUP_NODES = """2
+Voronoi accessible diagram for warmup with probe radius 1.0
+Ac 6.000 6.000 6.000 5.000
+Ac 3.000 6.000 6.000 3.000
+"""
+
+BUILD_SCRIPT = """using PackageCompiler
+create_sysimage([:PorousMaterials]; sysimage_path="{sysimage_path}", precompile_execution_file="{warmup}")
+"""
+
+
+def write_warmup(workdir, data_path, adsorbates=('Xe',), forcefield='UFF.csv'):
+    """
+    Write a warm-up workload to workdir: a tiny framework, its Voronoi nodes and
+    the single-component (in both energy modes, with a summary) and multi-component
+    PLD templates rendered for them, which together call all the PorousMaterials functions used by
+    the bundled templates. Returns the path of the warm-up script.
+    """
+    with open(os.path.join(workdir, 'warmup.cif'), 'w') as handle:
+        handle.write(WARMUP_CIF)
+    for name in ['warmup', 'warmup_PLD'] + ['warmup_' + adsorbate for adsorbate in adsorbates]:
+        with open(os.path.join(workdir, name + '.voro_accessible'), 'w') as handle:
+            handle.write(WARMUP_NODES)
+
+    parameters = {
+        'data_path': data_path,
+        'ff': forcefield,
+        'cutoff': 12.5,
+        'mixing': 'Lorentz-Berthelot',
+        'framework': 'warmup.cif',
+        'frameworkname': 'warmup',
+        'adsorbate': adsorbates[0],
+        'adsorbates': julia_list(adsorbates),
+        'temperature': 298.0,
+        'output_filename': 'Ev_warmup.csv',
+    }
+    summary = summary_setting([90, 50], [-100.0, -50.0, 0.0], [298.0, 273.0])
+    blocks = [
+        PorousMaterialsInput(dict(parameters, input_template='ev_vdw_kh_1comp_template',
+                                  output_dir='Output/1comp')).render(epilogue=False),
+        PorousMaterialsInput(dict(parameters, input_template='ev_vdw_kh_multicomp_pld_template',
+                                  output_dir='Output/multicomp_pld')).render(preamble=False, epilogue=False),
+        PorousMaterialsInput(dict(parameters, input_template='ev_vdw_kh_1comp_template',
+                                  output_dir='Output/grid', energy_mode='grid', grid_points=5,
+                                  summary_setting=summary)).render(preamble=False),
+    ]
+    warmup = os.path.join(workdir, 'warmup.jl')
+    with open(warmup, 'w') as handle:
+        handle.write('cd("{}")\n'.format(workdir))
+        handle.write('\n'.join(blocks))
+    return warmup
+
+
+def build_sysimage(sysimage_path, data_path, adsorbates=('Xe',), forcefield='UFF.csv', julia='julia'):
+    """
+    Build a PackageCompiler sysimage at sysimage_path (on the machine running the jobs)
+    by tracing the warm-up workload. data_path, forcefield and adsorbates must be available as
+    for the calculations. Only the compilation of PorousMaterials and its dependencies is captured:
+    the template functions are defined in Main by each input at runtime and are still compiled then.
+    Pass the path to the calculations with settings['sysimage'] or the `porousmaterials_sysimage`
+    extra of the code. Needs Julia >= 1.3 with the PackageCompiler package installed.
+    """
+    workdir = tempfile.mkdtemp()
+    warmup = write_warmup(workdir, data_path, adsorbates=adsorbates, forcefield=forcefield)
+    script = os.path.join(workdir, 'build_sysimage.jl')
+    with open(script, 'w') as handle:
+        handle.write(BUILD_SCRIPT.format(sysimage_path=os.path.abspath(sysimage_path), warmup=warmup))
+    subprocess.check_call([julia, script], cwd=workdir)
+    return sysimage_path
+
+
+# EOF
@@ -0,0 +1,384 @@
+
+# Voronoi node energy functions shared by all templates
+using Distributed
+@everywhere using PorousMaterials
+
+# Number of result rows written to the output files at once
+const WRITE_BLOCK = 10000
+
+# Timings (s) and sizes of the run by framework and (probe, adsorbate) pair, written to TIMINGS_FILE.
+# The startup includes loading PorousMaterials, from the time exported by the job script:
+# `date +%s.%N` prints a literal N without nanoseconds support (BSD, busybox), whole seconds are used then.
+const TIMINGS_FILE = "timings.json"
+function startup_time()
+    start = get(ENV, "PM_START_TIME", "")
+    seconds = something(tryparse(Float64, start), tryparse(Float64, split(start, ".")[1]), Some(nothing))
+    return seconds === nothing ? nothing : time() - seconds
+end
+const TIMINGS = Dict{String, Any}(
+    "startup_s" => startup_time(),
+    "frameworks" => Dict{String, Any}(),
+)
+
+# Minimal JSON of dictionaries, vectors, tuples, numbers, strings and nothing
+to_json(x::Nothing) = "null"
+to_json(x::Real) = isfinite(x) ? string(x) : "null"
+to_json(x::AbstractString) = string("\"", x, "\"")
+to_json(x::Union{AbstractVector, Tuple}) = string("[", join([to_json(item) for item in x], ","), "]")
+to_json(x::AbstractDict) = string("{", join([string(to_json(string(k)), ":", to_json(v)) for (k, v) in x], ","), "}")
+
+function write_timings()
+    open(TIMINGS_FILE, "w") do io
+        write(io, to_json(TIMINGS), "\n")
+    end
+end
+
+# Number of atoms of a framework, whatever the layout of its atoms (`hasproperty` needs Julia 1.2)
+function atom_count(framework)
+    if :species in fieldnames(typeof(framework.atoms))
+        return length(framework.atoms.species)
+    end
+    return length(framework.atoms)
+end
+
+# Unit cell, framework replicated for the cutoff and density of a framework file,
+# recording the loading time, replication factors and number of atoms as name
+function load_framework(path, ljff, name)
+    start = time()
+    unit_cell = Framework(path, check_charge_neutrality=false)
+    rep_factor = replication_factors(unit_cell.box, ljff)
+    framework = replicate(unit_cell, rep_factor)
+    density = crystal_density(framework)
+    TIMINGS["frameworks"][name] = Dict{String, Any}(
+        "load_s" => time() - start,
+        "replication_factors" => rep_factor,
+        "atoms" => atom_count(framework),
+        "pairs" => Dict{String, Any}(),
+    )
+    return unit_cell, framework, density
+end
+
+# Energy loop and writing times (s) of the nodes of a (probe, adsorbate) pair of framework name
+function record_pair(name, pair, n_nodes, energy_time, write_time)
+    TIMINGS["frameworks"][name]["pairs"][pair] = Dict{String, Any}(
+        "nodes" => n_nodes,
+        "energy_s" => energy_time,
+        "write_s" => write_time,
+        "nodes_per_s" => n_nodes / energy_time,
+    )
+end
+
+# Cartesian coordinates, radii and multiplicities of the nodes of a Zeo++ .voro_accessible file.
+# The multiplicities (6th column, written when the plugin deduplicates the nodes) are empty otherwise.
+function read_nodes(path)
+    lines = readlines(path)
+    n_nodes = parse(Int, lines[1])
+    xyz = Array{Float64}(undef, 3, n_nodes)
+    radii = Array{Float64}(undef, n_nodes)
+    multiplicity = Int[]
+    for k = 1:n_nodes
+        fields = split(lines[2+k])
+        xyz[:, k] = parse.(Float64, fields[2:4])
+        radii[k] = parse(Float64, fields[5])
+        if length(fields) > 5
+            push!(multiplicity, parse(Int, fields[6]))
+        end
+    end
+    return xyz, radii, multiplicity
+end
+
+# vdW energies (K) of one molecule placed at each column of xyz (Cartesian)
+@everywhere function chunk_energies(framework, molecule, ljff, xyz)
+    molecule = deepcopy(molecule)
+    energies = Array{Float64}(undef, size(xyz, 2))
+    for k = 1:size(xyz, 2)
+        translate_to!(molecule, framework.box.c_to_f * xyz[:, k])
+        energies[k] = vdw_energy(framework, molecule, ljff)
+    end
+    return energies
+end
+
+# Molecules of the adsorbates in the fractional coordinates of a framework, by framework and adsorbate,
+# built once and copied by the energy loops
+const MOLECULES = Dict{Tuple{String, String}, Any}()
+
+function framework_molecule(framework, adsorbate)
+    return get!(MOLECULES, (framework.name, adsorbate)) do
+        molecule = Molecule(adsorbate)
+        set_fractional_coords!(molecule, framework.box)
+        molecule
+    end
+end
+
+# vdW energies (K) of adsorbate at all nodes, split across Julia threads,
+# Distributed workers or evaluated serially depending on parallel
+function node_energies(framework, adsorbate, ljff, xyz, parallel)
+    molecule = framework_molecule(framework, adsorbate)
+    n_nodes = size(xyz, 2)
+    n_chunks = parallel == "threads" ? Threads.nthreads() : parallel == "distributed" ? nworkers() : 1
+    if n_chunks == 1 || n_nodes < 2
+        return chunk_energies(framework, molecule, ljff, xyz)
+    end
+    step = cld(n_nodes, n_chunks)
+    chunks = [xyz[:, k:min(k + step - 1, n_nodes)] for k = 1:step:n_nodes]
+    if parallel == "threads"
+        parts = Vector{Vector{Float64}}(undef, length(chunks))
+        Threads.@threads for i = 1:length(chunks)
+            parts[i] = chunk_energies(framework, molecule, ljff, chunks[i])
+        end
+    else
+        parts = pmap(CachingPool(workers()), chunk -> chunk_energies(framework, molecule, ljff, chunk), chunks)
+    end
+    return vcat(parts...)
+end
+
+# Energy grids (K) of the unit cells, by framework and adsorbate
+const GRIDS = Dict{Tuple{String, String}, Any}()
+
+# Trilinear interpolation of an energy grid spanning the unit cell at the Cartesian positions xyz
+function grid_energies(grid, xyz)
+    n_pts = collect(grid.n_pts)
+    energies = Array{Float64}(undef, size(xyz, 2))
+    for k = 1:size(xyz, 2)
+        u = mod.(grid.box.c_to_f * (xyz[:, k] - grid.origin), 1.0) .* (n_pts .- 1)
+        i = min.(floor.(Int, u), n_pts .- 2)
+        t = u - i
+        energy = 0.0
+        for a = 0:1, b = 0:1, c = 0:1
+            weight = (a == 1 ? t[1] : 1 - t[1]) * (b == 1 ? t[2] : 1 - t[2]) * (c == 1 ? t[3] : 1 - t[3])
+            energy += weight * grid.data[i[1] + 1 + a, i[2] + 1 + b, i[3] + 1 + c]
+        end
+        energies[k] = energy
+    end
+    return energies
+end
+
+# vdW energies (K) of adsorbate at all nodes, either evaluated directly on the replicated framework
+# ("direct") or interpolated in an energy grid of the unit cell with n_pts points per axis ("grid"),
+# computed once per framework and adsorbate
+function mode_energies(unit_cell, framework, adsorbate, ljff, xyz, parallel, energy_mode, n_pts)
+    if energy_mode == "grid"
+        grid = get!(GRIDS, (unit_cell.name, adsorbate)) do
+            energy_grid(unit_cell, Molecule(adsorbate), ljff; n_pts=(n_pts, n_pts, n_pts), units=:K)
+        end
+        return grid_energies(grid, xyz)
+    end
+    return node_energies(framework, adsorbate, ljff, xyz, parallel)
+end
+
+# Header of the Ev output files of n_nodes nodes, with a multiplicity column for deduplicated nodes.
+# The number of nodes ends the banner, so that incomplete files can be told apart.
+function write_header(io, density, temperature, columns, multiplicity, n_nodes)
+    write(io, "!!!Generated results using aiida-porousmaterials plugin!!! nodes: ", string(n_nodes), "\n")
+    write(io, "Framework Density\n")
+    write(io, string(density), "\n")
+    write(io, "Temperature(K)\n")
+    write(io, string(temperature), "\n")
+    write(io, columns, isempty(multiplicity) ? "" : ",multiplicity", "\n")
+end
+
+# Result rows of the nodes in range, written in blocks of WRITE_BLOCK rows;
+# suffix and the multiplicity, if any, are appended to each row
+function write_nodes(io, energies, temperature, radii, xyz, multiplicity, suffix, range)
+    buffer = IOBuffer()
+    for k in range
+        boltzmann_factor = exp(-energies[k] / temperature)
+        print(buffer, energies[k], ",", boltzmann_factor, ",", boltzmann_factor * energies[k], ",", radii[k], ",",
+              xyz[1, k], ",", xyz[2, k], ",", xyz[3, k], suffix)
+        print(buffer, isempty(multiplicity) ? "\n" : string(",", multiplicity[k], "\n"))
+        if k % WRITE_BLOCK == 0
+            write(io, take!(buffer))
+        end
+    end
+    write(io, take!(buffer))
+end
+
+# Nodes computed and flushed to the output file at once, the most work lost when a run is interrupted
+const CHECKPOINT_BLOCK = 10000
+
+# Number of complete rows of n_nodes nodes left at path by an interrupted run, with their energies
+# stored in energies, and the file truncated after them; nothing if there is no such file
+function resume_rows!(energies, path, n_nodes)
+    if !isfile(path)
+        return nothing
+    end
+    lines = readlines(path, keep=true)
+    if length(lines) < 6 || !all(endswith.(lines[1:6], "\n")) || !endswith(lines[1], " nodes: $(n_nodes)\n")
+        return nothing
+    end
+    rows = lines[7:min(end, 6 + n_nodes)]
+    if !isempty(rows) && !endswith(rows[end], "\n")
+        pop!(rows)
+    end
+    for (k, row) in enumerate(rows)
+        energies[k] = parse(Float64, split(row, ",")[1])
+    end
+    open(path, "r+") do io
+        truncate(io, sum(sizeof, lines[1:6]) + (isempty(rows) ? 0 : sum(sizeof, rows)))
+    end
+    return length(rows)
+end
+
+# Energies (K) of all nodes given by energies_of(xyz of a block of nodes), written to the output file path
+# block by block, resuming after the rows left by an interrupted run. Returns the energies and the
+# times (s) spent computing and writing them.
+function checkpointed_nodes(energies_of, path, density, temperature, columns, suffix, radii, xyz, multiplicity)
+    n_nodes = size(xyz, 2)
+    energies = Array{Float64}(undef, n_nodes)
+    done = resume_rows!(energies, path, n_nodes)
+    energy_time = 0.0
+    write_time = 0.0
+    io = open(path, done === nothing ? "w" : "a")
+    if done === nothing
+        write_header(io, density, temperature, columns, multiplicity, n_nodes)
+        done = 0
+    end
+    for start = done + 1:CHECKPOINT_BLOCK:n_nodes
+        stop = min(start + CHECKPOINT_BLOCK - 1, n_nodes)
+        energy_time += @elapsed energies[start:stop] = energies_of(xyz[:, start:stop])
+        write_time += @elapsed begin
+            write_nodes(io, energies, temperature, radii, xyz, multiplicity, suffix, start:stop)
+            flush(io)
+        end
+    end
+    close(io)
+    return energies, energy_time, write_time
+end
+
+# Energies (K) computed so far by framework and adsorbate, by node position, so that the nodes
+# shared by several node files (e.g. of different probes) are evaluated once
+const NODE_ENERGIES = Dict{Tuple{String, String}, Dict{NTuple{3, Float64}, Float64}}()
+
+# Energies at the positions xyz, evaluating only the positions not in memo yet with compute(xyz of them)
+function shared_energies(compute, memo, xyz)
+    positions = [(xyz[1, k], xyz[2, k], xyz[3, k]) for k = 1:size(xyz, 2)]
+    pending = unique([position for position in positions if !haskey(memo, position)])
+    if !isempty(pending)
+        for (position, energy) in zip(pending, compute(reduce(hcat, [collect(position) for position in pending])))
+            memo[position] = energy
+        end
+    end
+    return [memo[position] for position in positions]
+end
+
+# Evaluate the (probe, node file, adsorbates) entries of plan for the framework name: every node file is
+# parsed once, every molecule built once and the nodes shared by several files evaluated once per adsorbate.
+# Each (probe, adsorbate) pair is written to output_dir/Ev_vdw_<name>_<probe>_<adsorbate>.csv.
+function evaluate_plan(plan, working_dir, output_dir, name, unit_cell, framework, ljff, density, temperature,
+                       setting, parallel, energy_mode, n_pts)
+    nodes = Dict(probe => read_nodes(working_dir * file) for (probe, file, _) in plan)
+    columns = "Ev_K,boltzmann_factor,weighted_energy_K,Rv_A,x,y,z,adsorbate"
+    for (probe, _, adsorbates) in plan
+        xyz, radii, multiplicity = nodes[probe]
+        for adsorbate in adsorbates
+            memo = get!(() -> Dict{NTuple{3, Float64}, Float64}(), NODE_ENERGIES, (name, adsorbate))
+            output = output_dir * "/Ev_vdw_" * name * "_" * probe * "_" * adsorbate * ".csv"
+            suffix = "," * adsorbate
+            energies, energy_time, write_time = checkpointed_nodes(output, density, temperature, columns, suffix,
+                                                                   radii, xyz, multiplicity) do block
+                shared_energies(memo, block) do pending
+                    mode_energies(unit_cell, framework, adsorbate, ljff, pending, parallel, energy_mode, n_pts)
+                end
+            end
+            summarize(output, density, temperature, energies, radii, xyz, multiplicity, setting)
+            record_pair(name, probe * "_" * adsorbate, size(xyz, 2), energy_time, write_time)
+        end
+    end
+end
+
+# Reductions of the Ev output files computed where they are written, by output file path, so that
+# only SUMMARY_FILE has to be retrieved. They mirror the reductions of the plugin's parser.
+const SUMMARY_FILE = "summary.json"
+const SUMMARIES = Dict{String, Any}()
+const K_TO_KJ_MOL = 1.0 / 120.273
+
+# Percentiles of values where each value is repeated weights times, with linear interpolation
+function weighted_percentiles(values, weights, percentiles)
+    order = sortperm(values)
+    sorted = values[order]
+    cumulative = cumsum(weights[order])
+    result = Float64[]
+    for percentile in percentiles
+        position = percentile / 100 * (cumulative[end] - 1)
+        lower = sorted[searchsortedlast(cumulative, floor(position)) + 1]
+        upper = sorted[searchsortedlast(cumulative, ceil(position)) + 1]
+        push!(result, lower + (upper - lower) * (position - floor(position)))
+    end
+    return result
+end
+
+# Indices (from 0, as in the output files) and rows of the nodes k, as the parser reports the extreme nodes
+function node_rows(energies, temperature, radii, xyz, nodes)
+    rows = [[exp(-energies[k] / temperature), exp(-energies[k] / temperature) * energies[k], radii[k],
+             xyz[1, k], xyz[2, k], xyz[3, k]] for k in nodes]
+    return [nodes .- 1, rows]
+end
+
+# Nodes of the energies at their extreme (minimum or maximum), none without energies
+extreme_nodes(energies, extreme) = isempty(energies) ? Int[] : findall(energies .== extreme(energies))
+
+# Boltzmann-weighted sums and extreme nodes of the energies at temperature, the part of a summary depending on it
+function temperature_summary(energies, temperature, radii, xyz, weights)
+    boltzmann_factors = exp.(-energies ./ temperature)
+    return Dict{String, Any}(
+        "temperature" => temperature,
+        "minimum_nodes" => node_rows(energies, temperature, radii, xyz, extreme_nodes(energies, minimum)),
+        "maximum_nodes" => node_rows(energies, temperature, radii, xyz, extreme_nodes(energies, maximum)),
+        "boltzmann_factor_sum" => sum(boltzmann_factors .* weights),
+        "weighted_energy_sum" => sum(boltzmann_factors .* energies .* weights),
+    )
+end
+
+# Summary of the output file path, unless setting is nothing; setting holds the percentiles
+# (ev_setting), the bin edges (kJ/mol) of the energy histogram and the temperatures (K) of the
+# Boltzmann-weighted sums, of which the file and the main entries use the first one. The summary
+# of a file without nodes (a probe reaching none) has a zero count and no extremes, percentiles or histogram
+function summarize(path, density, temperature, energies, radii, xyz, multiplicity, setting)
+    if setting === nothing
+        return
+    end
+    weights = isempty(multiplicity) ? ones(Int, length(energies)) : multiplicity
+    summary = merge(temperature_summary(energies, temperature, radii, xyz, weights), Dict{String, Any}(
+        "density" => density,
+        "rows" => length(energies),
+        "count" => sum(weights),
+        "minimum" => nothing,
+        "maximum" => nothing,
+        "by_temperature" => [temperature_summary(energies, t, radii, xyz, weights) for t in setting.temperatures],
+    ))
+    SUMMARIES[path] = summary
+    if isempty(energies)
+        return
+    end
+    edges = setting.bin_edges
+    counts = zeros(Int, length(edges) - 1)
+    below = 0
+    above = 0
+    for k = 1:length(energies)
+        energy = energies[k] * K_TO_KJ_MOL
+        if energy < edges[1]
+            below += weights[k]
+        elseif energy > edges[end]
+            above += weights[k]
+        else
+            counts[min(searchsortedlast(edges, energy), length(counts))] += weights[k]
+        end
+    end
+    merge!(summary, Dict{String, Any}(
+        "minimum" => minimum(energies),
+        "maximum" => maximum(energies),
+        "percentiles" => weighted_percentiles(energies, weights, setting.ev_setting),
+        "bin_edges" => edges,
+        "counts" => counts,
+        "below" => below,
+        "above" => above,
+    ))
+end
+
+function write_summaries()
+    if !isempty(SUMMARIES)
+        open(SUMMARY_FILE, "w") do io
+            write(io, to_json(SUMMARIES), "\n")
+        end
+    end
+end
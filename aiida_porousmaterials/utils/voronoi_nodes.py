@@ -0,0 +1,115 @@
+"""Reading, reducing and writing Zeo++ accessible Voronoi node files."""
+import numpy as np
+
+
+def _close_nodes(xyz, cell, tolerance):
+    """
+    Sparse CSR matrix whose rows hold the nodes at xyz within tolerance (Angstrom) of each node,
+    under periodic boundary conditions of the lattice vectors cell (as rows).
+    """
+    # scipy is only imported when deduplicating, not when loading the calculation plugin.
+    from scipy.sparse import coo_matrix
+    from scipy.spatial import cKDTree
+
+    num_nodes = len(xyz)
+    inverse = np.linalg.inv(cell)
+    fractional = np.mod(xyz.dot(inverse), 1.0)
+    fractional[fractional >= 1.0] = 0.0
+
+    # Nodes within tolerance in Cartesian space are within this radius in fractional space.
+    fractional_tolerance = tolerance * np.linalg.norm(inverse)
+    pairs = cKDTree(fractional, boxsize=1.0).query_pairs(fractional_tolerance, output_type='ndarray')
+
+    # Keep only the pairs closer than tolerance with the minimum image convention.
+    delta = fractional[pairs[:, 0]] - fractional[pairs[:, 1]]
+    delta -= np.round(delta)
+    pairs = pairs[np.linalg.norm(delta.dot(cell), axis=1) <= tolerance]
+
+    # Nodes within tolerance of each node, as rows of a sparse matrix.
+    rows = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    columns = np.concatenate([pairs[:, 1], pairs[:, 0]])
+    return coo_matrix((np.ones(len(rows)), (rows, columns)), shape=(num_nodes, num_nodes)).tocsr()
+
+
+class VoronoiNodes:
+    """
+    Accessible Voronoi nodes of a `.voro_accessible` file: Cartesian
+    coordinates (n x 3, Angstrom), radii and, once deduplicated,
+    the number of original nodes each node stands for.
+    """
+
+    def __init__(self, comment, xyz, radii, multiplicity=None):
+        self.comment = comment
+        self.xyz = xyz
+        self.radii = radii
+        self.multiplicity = multiplicity
+
+    @property
+    def represented(self):
+        """Number of nodes of the original file these nodes stand for."""
+        return len(self.radii) if self.multiplicity is None else int(self.multiplicity.sum())
+
+    @classmethod
+    def from_handle(cls, handle):
+        """Read a `.voro_accessible` file from an open text handle."""
+        num_nodes = int(handle.readline())
+        comment = handle.readline().rstrip('\n')
+        block = np.loadtxt(handle, usecols=(1, 2, 3, 4), ndmin=2, max_rows=num_nodes)
+        return cls(comment, block[:, :3], block[:, 3])
+
+    def write(self, handle):
+        """Write the nodes in the `.voro_accessible` format, multiplicities as a 6th column."""
+        handle.write('{}\n{}\n'.format(len(self.radii), self.comment))
+        if self.multiplicity is None:
+            np.savetxt(handle, np.column_stack([self.xyz, self.radii]), fmt='Ac %.3f %.3f %.3f %.3f')
+        else:
+            block = np.column_stack([self.xyz, self.radii, self.multiplicity])
+            np.savetxt(handle, block, fmt='Ac %.3f %.3f %.3f %.3f %d')
+
+    def deduplicate(self, cell, tolerance):
+        """
+        Merge the nodes closer than tolerance (Angstrom) to a representative under
+        periodic boundary conditions, e.g. symmetry copies sitting on the same site.
+        Taking the nodes in the order of the file, each node not merged yet becomes a
+        representative and takes in the nodes within tolerance of it which are not
+        merged yet, so that no node is further than tolerance from the node evaluated
+        for it (unlike groups of nodes chained by close pairs, which may span a pore).
+        The multiplicity of a representative is the number of nodes it stands for.
+        cell holds the lattice vectors as rows, in the Cartesian frame of the nodes.
+        """
+        num_nodes = len(self.radii)
+        close = _close_nodes(self.xyz, cell, tolerance)
+        indptr = close.indptr.tolist()
+        indices = close.indices
+        labels = np.full(num_nodes, -1, dtype=np.int64)
+        for node in range(num_nodes):
+            if labels[node] >= 0:
+                continue
+            labels[node] = node
+            if indptr[node] == indptr[node + 1]:
+                continue
+            neighbours = indices[indptr[node]:indptr[node + 1]]
+            labels[neighbours[labels[neighbours] < 0]] = node
+
+        # Representatives in the order of the original file.
+        representatives, groups = np.unique(labels, return_inverse=True)
+        previous = np.ones(num_nodes) if self.multiplicity is None else self.multiplicity
+        multiplicity = np.bincount(groups, weights=previous, minlength=len(representatives)).astype(np.int64)
+        return VoronoiNodes(self.comment, self.xyz[representatives], self.radii[representatives], multiplicity)
+
+    def select(self, min_radius=None, max_nodes=None):
+        """
+        Keep the nodes with a radius of at least min_radius (Angstrom) and, of those,
+        only the max_nodes largest ones (the first ones of the file on ties).
+        The kept nodes stay in the order of the original file.
+        """
+        keep = np.arange(len(self.radii))
+        if min_radius is not None:
+            keep = keep[self.radii >= min_radius]
+        if max_nodes is not None and len(keep) > max_nodes:
+            keep = np.sort(keep[np.argsort(-self.radii[keep], kind='stable')[:max_nodes]])
+        multiplicity = None if self.multiplicity is None else self.multiplicity[keep]
+        return VoronoiNodes(self.comment, self.xyz[keep], self.radii[keep], multiplicity)
+
+
+# EOF
@@ -0,0 +1,357 @@
+""" PorousMaterials WorkChain Plugin """
+import io
+import json
+import os
+import tempfile
+from contextlib import ExitStack
+
+import numpy as np
+
+from aiida.common import AttributeDict
+from aiida.engine import WorkChain, calcfunction, while_
+from aiida.orm import Dict, FolderData, Int, RemoteData, SinglefileData
+from aiida_porousmaterials.calculations import PorousMaterialsCalculation
+from aiida_porousmaterials.utils.ev_arrays import EV_ARRAYS_FILENAME, write_ev_arrays
+from aiida_porousmaterials.utils.input_generator import DEFAULT_GRID_POINTS
+from aiida_porousmaterials.utils.input_hash import get_adsorbates
+from aiida_porousmaterials.utils.retrieved import (
+    NODE_FILTER_FILE, OUTPUT_FOLDER, TIMINGS_FILE, list_output_files, parse_retrieved
+)
+from aiida_porousmaterials.utils.shards import (
+    DEFAULT_SIZING, count_nodes, estimate_seconds, merge_ev_outputs, merge_timings, plan_shards, replication_factors,
+    split_nodes
+)
+from aiida_porousmaterials.utils.voronoi_nodes import VoronoiNodes
+
+# Parameters of the Voronoi node filters, applied to all the nodes before they are split.
+NODE_FILTER_PARAMETERS = ('node_tolerance', 'node_min_radius', 'node_max_number')
+# Restarts of an interrupted calculation from its remote folder, each resuming after the last written nodes.
+DEFAULT_MAX_RESTARTS = 2
+# Extras of the calculations of the shards, set to their index, and of the workchains which split the nodes,
+# set to the number of shards, so that the results of sharded runs are exported from the merged outputs only.
+SHARD_EXTRA = 'porousmaterials_shard'
+SHARDS_EXTRA = 'porousmaterials_shards'
+SHARDED_PROCESS_TYPE = 'aiida.workflows:porousmaterials.sharded'
+
+
+@calcfunction
+def split_voronoi_nodes(shards, parameters, structure, **acc_voronoi_nodes):
+    """
+    Split every Voronoi node file into shards files of consecutive nodes, as <name>_shard_<index>,
+    fewer if a file has fewer nodes. The node filters of the parameters are applied first,
+    as the calculation would, and then returned as 'node_filter' along with the parameters
+    without the filters, as 'parameters'.
+    """
+    parameters = parameters.get_dict()
+    tolerance = parameters.get('node_tolerance', None)
+    min_radius = parameters.get('node_min_radius', None)
+    max_nodes = parameters.get('node_max_number', None)
+    filtered = not (tolerance is None and min_radius is None and max_nodes is None)
+
+    texts = {}
+    node_filter = {}
+    for name, fobj in acc_voronoi_nodes.items():
+        with fobj.open(mode='r') as handle:
+            if not filtered:
+                texts[name] = handle.read()
+                continue
+            nodes = VoronoiNodes.from_handle(handle)
+        reduced = nodes
+        if tolerance is not None:
+            reduced = reduced.deduplicate(np.array(structure.get_ase().get_cell()), tolerance)
+        if min_radius is not None or max_nodes is not None:
+            reduced = reduced.select(min_radius=min_radius, max_nodes=max_nodes)
+            node_filter[name] = {
+                'total': len(nodes.radii),
+                'evaluated': len(reduced.radii),
+                'skipped': len(nodes.radii) - reduced.represented,
+            }
+        text = io.StringIO()
+        reduced.write(text)
+        texts[name] = text.getvalue()
+
+    shards = min([shards.value] + [count_nodes(io.StringIO(text)) for text in texts.values()])
+    results = {}
+    for name, text in texts.items():
+        for index, shard in enumerate(split_nodes(io.StringIO(text), max(shards, 1))):
+            results['{}_shard_{}'.format(name, index)] = SinglefileData(
+                file=io.BytesIO(shard.encode('utf8')), filename=name + '.voro_accessible'
+            )
+    if filtered:
+        results['parameters'] = Dict(
+            dict={key: value for key, value in parameters.items() if key not in NODE_FILTER_PARAMETERS}
+        )
+    if node_filter:
+        results['node_filter'] = Dict(dict=node_filter)
+    return results
+
+
+def node_evaluations(inputs, parameters):
+    """
+    (nodes, framework atoms, probes) evaluated for each Voronoi node file of the calculation inputs,
+    as `estimate_seconds` takes them, and the number of nodes of each file.
+    """
+    # Framework atoms within the cutoff of a node, after the replication of the unit cell.
+    atoms = {}
+    for name, structure in inputs.structure.items():
+        ase = structure.get_ase()
+        atoms[name] = len(ase) * int(np.prod(replication_factors(ase.get_cell(), parameters['cutoff'])))
+
+    # A grid has its points evaluated, whatever the number of nodes.
+    grid_points = parameters.get('grid_points', DEFAULT_GRID_POINTS)**3
+    adsorbates = get_adsorbates(parameters)
+    pld_adsorbates = json.loads(parameters['pld_adsorbates']) if 'pld_adsorbates' in parameters else adsorbates
+    evaluations = []
+    num_nodes = []
+    for name, fobj in inputs.acc_voronoi_nodes.items():
+        with fobj.open(mode='r') as handle:
+            nodes = count_nodes(handle)
+        nodes = min(nodes, parameters.get('node_max_number', None) or nodes)
+        num_nodes.append(nodes)
+        frameworks = [key for key in atoms if name.startswith(key)]
+        if not frameworks:
+            continue
+        framework = max(frameworks, key=len)
+        if parameters.get('energy_mode', 'direct') == 'grid':
+            nodes = grid_points
+        # As `plan_entries`: the nodes of an adsorbate probe are evaluated with that adsorbate,
+        # those of the other probes (e.g. PLD) with every PLD adsorbate.
+        probes = 1 if name[len(framework) + 1:] in adsorbates else len(pld_adsorbates)
+        evaluations.append((nodes, atoms[framework], probes))
+    return evaluations, num_nodes
+
+
+@calcfunction
+def merge_shards(parameters, settings=None, node_filter=None, **shards):
+    """
+    Merge the retrieved folders of the shards, given as shard_<index>, into the outputs of a single
+    calculation on all the nodes: the output files are the rows of the shards one after the other,
+    so they and output_parameters are those of an unsharded calculation. The timings of the shards
+    are kept as a list.
+    """
+    parameters = parameters.get_dict()
+    settings = settings.get_dict() if settings is not None else {}
+    folders = [shards['shard_{}'.format(index)] for index in range(len(shards))]
+    output_files = list_output_files(folders[0])
+
+    merged = FolderData()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.makedirs(os.path.join(tmpdir, OUTPUT_FOLDER))
+        for _, _, key in output_files:
+            with open(os.path.join(tmpdir, key), 'w') as target, ExitStack() as stack:
+                merge_ev_outputs([stack.enter_context(folder.open(key, mode='r')) for folder in folders], target)
+        with open(os.path.join(tmpdir, TIMINGS_FILE), 'w') as target, ExitStack() as stack:
+            handles = [
+                stack.enter_context(folder.open(TIMINGS_FILE, mode='r'))
+                for folder in folders
+                if TIMINGS_FILE in folder.list_object_names()
+            ]
+            json.dump(merge_timings(handles), target)
+        if node_filter is not None:
+            with open(os.path.join(tmpdir, NODE_FILTER_FILE), 'w') as target:
+                json.dump(node_filter.get_dict(), target)
+        merged.put_object_from_tree(tmpdir)
+
+    output_parameters, ev_arrays = parse_retrieved(merged, parameters, settings, output_files=output_files)
+
+    results = {'output_parameters': Dict(dict=output_parameters)}
+    if settings.get('output_storage', 'csv') == 'npz':
+        with tempfile.TemporaryDirectory() as tmpdir:
+            arrays_path = write_ev_arrays(ev_arrays, os.path.join(tmpdir, EV_ARRAYS_FILENAME))
+            results['ev_output_arrays'] = SinglefileData(file=arrays_path)
+    else:
+        for _, name, key in output_files:
+            with merged.open(key, mode='rb') as handle:
+                results[name] = SinglefileData(file=handle, filename=os.path.basename(key))
+    return results
+
+
+class PorousMaterialsShardedWorkChain(WorkChain):
+    """
+    Run a PorousMaterialsCalculation with resources and walltime estimated from the number
+    of Voronoi nodes and framework atoms. If the estimate does not fit the maximum walltime,
+    the nodes are split into shards computed by parallel calculations, whose outputs are
+    merged into those of a single calculation. Calculations interrupted before the end of
+    their node loop are restarted from their remote folder, resuming their output files.
+    """
+
+    @classmethod
+    def define(cls, spec):
+        """
+        The important section to define the class, inputs, outline and outputs.
+        """
+        super(PorousMaterialsShardedWorkChain, cls).define(spec)
+
+        spec.expose_inputs(PorousMaterialsCalculation, namespace='porousmaterials')
+        spec.input(
+            'sizing',
+            valid_type=Dict,
+            required=False,
+            help='Cost model and limits of the calculations, see DEFAULT_SIZING of utils.shards, '
+            'and max_procs, the most processes of one calculation with a parallel node loop.'
+        )
+        spec.input(
+            'max_restarts',
+            valid_type=Int,
+            required=False,
+            help='Restarts of each interrupted calculation, {} by default.'.format(DEFAULT_MAX_RESTARTS)
+        )
+
+        spec.outline(
+            cls.estimate,
+            cls.run_calculations,
+            while_(cls.should_restart)(cls.restart_calculations),
+            cls.results,
+        )
+
+        # Merged shards have no remote folder nor retrieved folder of their own.
+        spec.expose_outputs(PorousMaterialsCalculation, exclude=('remote_folder', 'retrieved'))
+        spec.output(
+            'remote_folder',
+            valid_type=RemoteData,
+            required=False,
+            help='remote_folder of the calculation, if the nodes were not split into shards'
+        )
+        spec.output(
+            'retrieved',
+            valid_type=FolderData,
+            required=False,
+            help='retrieved folder of the calculation, if the nodes were not split into shards'
+        )
+        spec.exit_code(401, 'ERROR_CALCULATION_FAILED', message='A PorousMaterialsCalculation did not finish.')
+
+    def estimate(self):
+        """Estimate the cost of the calculation, then choose its processes, walltime and number of shards."""
+        inputs = self.exposed_inputs(PorousMaterialsCalculation, 'porousmaterials')
+        parameters = inputs.parameters.get_dict()
+        sizing = dict(DEFAULT_SIZING, **(self.inputs.sizing.get_dict() if 'sizing' in self.inputs else {}))
+
+        evaluations, num_nodes = node_evaluations(inputs, parameters)
+        loop_seconds = estimate_seconds(evaluations, sizing)
+
+        # Processes of the node loop, up to max_procs, to bring the walltime under its maximum.
+        procs = inputs.metadata.options.resources.get('num_mpiprocs_per_machine', 1)
+        loop_procs = 1
+        if parameters.get('parallel', 'serial') != 'serial':
+            if sizing.get('max_procs', None):
+                budget = max(sizing['max_wallclock_seconds'] - sizing['startup_seconds'], 1)
+                needed = np.ceil(sizing['safety_factor'] * loop_seconds / budget)
+                procs = int(min(sizing['max_procs'], max(1, needed)))
+            loop_procs = procs
+
+        # Only the direct energies of a single framework computed from scratch are split.
+        shardable = not parameters.get('batch', False) and 'previous_ev_output_file' not in inputs
+        shardable = shardable and parameters.get('energy_mode', 'direct') == 'direct' and len(inputs.structure) == 1
+        # At least one shard, even with a node file without nodes.
+        max_shards = max(1, int(min([sizing['max_shards']] + num_nodes))) if shardable else 1
+        shards, walltime = plan_shards(loop_seconds, loop_procs, dict(sizing, max_shards=max_shards))
+
+        self.ctx.shards = shards
+        self.ctx.restarts = 0
+        self.ctx.node_filter = None
+        self.ctx.procs = procs
+        self.ctx.walltime = walltime
+        self.report(
+            'estimated energy loop of {:.0f} s, running {} calculation(s) of {} process(es) and {} s'.format(
+                loop_seconds, shards, procs, walltime
+            )
+        )
+
+    def run_calculations(self):
+        """Submit the calculation, or one calculation per shard of the Voronoi nodes."""
+        inputs = AttributeDict(self.exposed_inputs(PorousMaterialsCalculation, 'porousmaterials'))
+        options = dict(inputs.metadata.options)
+        options['resources'] = dict(options['resources'], num_mpiprocs_per_machine=self.ctx.procs)
+        options['max_wallclock_seconds'] = self.ctx.walltime
+        inputs.metadata = dict(inputs.metadata, options=options)
+
+        if self.ctx.shards == 1:
+            self.to_context(shard_0=self.submit(PorousMaterialsCalculation, **inputs))
+            return
+
+        split = split_voronoi_nodes(
+            shards=Int(self.ctx.shards),
+            parameters=inputs.parameters,
+            structure=list(inputs.structure.values())[0],
+            **inputs.acc_voronoi_nodes
+        )
+        self.ctx.node_filter = split.get('node_filter', None)
+        first = next(iter(inputs.acc_voronoi_nodes))
+        self.ctx.shards = len([key for key in split if key.startswith(first + '_shard_')])
+        self.node.set_extra(SHARDS_EXTRA, self.ctx.shards)
+
+        # The shards are merged from their output files, which must all be retrieved.
+        settings = inputs.settings.get_dict() if 'settings' in inputs else {}
+        settings.update({'output_retrieval': 'full', 'output_storage': 'csv'})
+        for index in range(self.ctx.shards):
+            shard_inputs = AttributeDict(inputs)
+            shard_inputs.parameters = split.get('parameters', inputs.parameters)
+            shard_inputs.settings = Dict(dict=settings)
+            shard_inputs.acc_voronoi_nodes = {
+                name: split['{}_shard_{}'.format(name, index)] for name in inputs.acc_voronoi_nodes
+            }
+            shard_inputs.metadata = dict(inputs.metadata, call_link_label='shard_{}'.format(index))
+            self._submit_shard(index, PorousMaterialsCalculation, **shard_inputs)
+
+    def _submit_shard(self, index, process, **inputs):
+        """Submit the calculation of the shard index, tagged as such when the nodes are split."""
+        node = self.submit(process, **inputs)
+        if self.ctx.shards > 1:
+            node.set_extra(SHARD_EXTRA, index)
+        self.to_context(**{'shard_{}'.format(index): node})
+
+    def _calculations(self):
+        """Latest calculation of each shard, in the order of the shards."""
+        return [self.ctx['shard_{}'.format(index)] for index in range(self.ctx.shards)]
+
+    def _interrupted(self):
+        """Indices of the shards whose latest calculation was interrupted before writing all nodes."""
+        exit_status = PorousMaterialsCalculation.exit_codes.ERROR_INCOMPLETE_OUTPUT_FILE.status
+        return [index for index, calc in enumerate(self._calculations()) if calc.exit_status == exit_status]
+
+    def should_restart(self):
+        """Whether some calculations were interrupted and may be restarted."""
+        max_restarts = self.inputs.max_restarts.value if 'max_restarts' in self.inputs else DEFAULT_MAX_RESTARTS
+        return bool(self._interrupted()) and self.ctx.restarts < max_restarts
+
+    def restart_calculations(self):
+        """Restart the interrupted calculations from their remote folder, resuming their output files."""
+        self.ctx.restarts += 1
+        for index in self._interrupted():
+            calc = self.ctx['shard_{}'.format(index)]
+            self.report('{}<{}> was interrupted, resuming it'.format(calc.process_label, calc.pk))
+            builder = calc.get_builder_restart()
+            builder.parent_folder = calc.outputs.remote_folder
+            self._submit_shard(index, builder)
+
+    def results(self):
+        """Expose the outputs of the calculation, or merge those of the shards."""
+        calculations = self._calculations()
+        for calculation in calculations:
+            if not calculation.is_finished_ok:
+                self.report('{}<{}> did not finish'.format(calculation.process_label, calculation.pk))
+                return self.exit_codes.ERROR_CALCULATION_FAILED
+
+        if len(calculations) == 1:
+            self.out_many(self.exposed_outputs(calculations[0], PorousMaterialsCalculation))
+            self.out('remote_folder', calculations[0].outputs.remote_folder)
+            self.out('retrieved', calculations[0].outputs.retrieved)
+            return None
+
+        inputs = self.exposed_inputs(PorousMaterialsCalculation, 'porousmaterials')
+        merge_inputs = {'shard_{}'.format(index): calc.outputs.retrieved for index, calc in enumerate(calculations)}
+        if 'settings' in inputs:
+            merge_inputs['settings'] = inputs.settings
+        if self.ctx.node_filter is not None:
+            merge_inputs['node_filter'] = self.ctx.node_filter
+        merged = merge_shards(parameters=inputs.parameters, **merge_inputs)
+
+        self.out('output_parameters', merged.pop('output_parameters'))
+        if 'ev_output_arrays' in merged:
+            self.out('ev_output_arrays', merged.pop('ev_output_arrays'))
+        if merged:
+            self.out('ev_output_file', merged)
+        return None
+
+
+# EOF
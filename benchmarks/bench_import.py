@@ -0,0 +1,61 @@
+"""
+Import time of the plugin modules, measured with `python -X importtime` in a fresh interpreter:
+    cd benchmarks && pytest bench_import.py --import-budget 0.15
+Resolving the entry points must not import the dependencies which are only needed to parse
+outputs or deduplicate Voronoi nodes, and must stay within the budget once AiiDA is loaded.
+"""
+import subprocess
+import sys
+
+import pytest
+
+# Dependencies imported only by the functions using them.
+HEAVY_MODULES = ('pandas', 'scipy')
+# Modules loaded by a daemon worker or `verdi` before a plugin, not counted in its budget.
+AIIDA_MODULES = ('numpy', 'aiida.common', 'aiida.engine', 'aiida.orm', 'aiida.parsers', 'aiida.plugins')
+# Module and modules imported before it, by name.
+MODULES = {
+    'utils': ('aiida_porousmaterials.utils', ('numpy',)),
+    'calculation': ('aiida_porousmaterials.calculations', AIIDA_MODULES),
+    'parser': ('aiida_porousmaterials.parser', AIIDA_MODULES),
+    'workchain': ('aiida_porousmaterials.workflows', AIIDA_MODULES),
+}
+MARKER = 'porousmaterials-import'
+
+
+def import_times(module, preload):
+    """
+    Cumulative import time in seconds of the modules newly imported by `import module`
+    in a fresh interpreter which has imported preload, by module name.
+    """
+    code = ''.join('import {}; '.format(name) for name in preload)
+    code += 'import sys; sys.stderr.write("{}\\n"); import {}'.format(MARKER, module)
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            stderr=subprocess.PIPE,
+                            universal_newlines=True,
+                            check=True).stderr
+    times = {}
+    for line in stderr.split(MARKER, 1)[1].splitlines():
+        if line.startswith('import time:') and '[us]' not in line:
+            _, cumulative, name = line.split('|')
+            times[name.strip()] = (int(cumulative), name.startswith('  '))
+    return times
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason='-X importtime needs Python 3.7')
+@pytest.mark.parametrize('name', sorted(MODULES))
+def bench_import(request, name):
+    module, preload = MODULES[name]
+    if preload is AIIDA_MODULES:
+        pytest.importorskip('aiida')
+    times = import_times(module, preload)
+
+    heavy = sorted(imported for imported in times if imported.split('.')[0] in HEAVY_MODULES)
+    assert not heavy, 'importing {} imports {}'.format(module, ', '.join(heavy))
+
+    seconds = sum(cumulative for cumulative, nested in times.values() if not nested) * 1e-6
+    budget = request.config.getoption('import_budget')
+    assert seconds <= budget, 'importing {} takes {:.3f} s, over the budget of {} s'.format(module, seconds, budget)
+
+
+# EOF
@@ -0,0 +1,111 @@
+"""
+Time and peak memory of the Python hot paths of the plugin on synthetic data:
+    cd benchmarks && pytest --sizes 10000,100000 --benchmark-json=results.json
+Compare a run with a saved one with `--benchmark-compare` to catch regressions.
+"""
+import os
+
+import pytest
+
+from aiida_porousmaterials.utils import MemoryFolder, PorousMaterialsInput, parse_base_output, parse_retrieved
+from aiida_porousmaterials.utils.input_generator import julia_list
+
+FILES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'examples', 'simple_calculations',
+                          'files')
+ADSORBATES = ['Xe', 'Kr']
+PARAMETERS = {
+    'data_path': '/path/to/data',
+    'ff': 'UFF.csv',
+    'cutoff': 12.5,
+    'mixing': 'Lorentz-Berthelot',
+    'framework': 'HKUST1.cif',
+    'frameworkname': 'HKUST1',
+    'adsorbates': julia_list(ADSORBATES),
+    'temperature': 298.0,
+    'input_template': 'ev_vdw_kh_multicomp_template',
+}
+
+
+def retrieved_folder(synthetic_files, num_nodes):
+    """MemoryFolder with the outputs of a multi-component calculation on HKUST1."""
+    files = {'timings.json': '{}'}
+    for adsorbate in ADSORBATES:
+        with open(synthetic_files('ev', num_nodes, adsorbate)) as handle:
+            files['Output/Ev_vdw_HKUST1_{0}_{0}.csv'.format(adsorbate)] = handle.read()
+    return MemoryFolder(files)
+
+
+@pytest.mark.parametrize('chunksize', [None, 10000], ids=['whole', 'chunked'])
+def bench_parse_base_output(measure, synthetic_files, num_nodes, chunksize):
+    path = synthetic_files('ev', num_nodes)
+    results = measure(parse_base_output, path, chunksize=chunksize)
+    assert results['total_number_of_accessible_Voronoi_nodes'] == num_nodes
+
+
+@pytest.mark.parametrize('template', ['ev_vdw_kh_1comp_template', 'ev_vdw_kh_multicomp_pld_template'])
+def bench_render(measure, template):
+    parameters = dict(PARAMETERS, input_template=template, adsorbate='Xe', output_filename='Ev_HKUST1.csv')
+    assert 'using PorousMaterials' in measure(lambda: PorousMaterialsInput(parameters).render())
+
+
+def bench_parse_retrieved(measure, synthetic_files, num_nodes):
+    folder = retrieved_folder(synthetic_files, num_nodes)
+    output_parameters, _ = measure(parse_retrieved, folder, PARAMETERS, {})
+    assert sorted(output_parameters) == sorted(ADSORBATES + ['timings'])
+
+
+@pytest.mark.parametrize('reduction', [{}, {'node_tolerance': 0.05, 'node_min_radius': 2.0}], ids=['copy', 'reduce'])
+def bench_prepare_for_submission(measure, aiida_local_code_factory, synthetic_files, num_nodes, reduction):
+    """Dry run, i.e. prepare_for_submission and the upload to a local sandbox."""
+    from aiida.engine import run
+    from aiida.orm import Dict, SinglefileData
+    from aiida.plugins import CalculationFactory, DataFactory
+
+    builder = CalculationFactory('porousmaterials').get_builder()
+    # Only dry runs are made, so any executable will do.
+    builder.code = aiida_local_code_factory('porousmaterials', 'bash')
+    builder.structure = {'HKUST1': DataFactory('cif')(file=os.path.join(FILES_PATH, 'HKUST1.cif'))}
+    builder.acc_voronoi_nodes = {
+        'HKUST1_' + adsorbate: SinglefileData(file=synthetic_files('voro', num_nodes, adsorbate))
+        for adsorbate in ADSORBATES
+    }
+    builder.parameters = Dict(dict=dict(PARAMETERS, **reduction))
+    builder.metadata.options.resources = {'num_machines': 1, 'num_mpiprocs_per_machine': 1}
+    builder.metadata.options.withmpi = False
+    builder.metadata.dry_run = True
+    builder.metadata.store_provenance = False
+    measure(run, builder)
+
+
+def bench_parser(measure, aiida_profile, synthetic_files, num_nodes):  # pylint: disable=unused-argument
+    """PorousMaterialsParser.parse of a stand-in calculation whose retrieved folder is a MemoryFolder."""
+    from aiida.common import AttributeDict
+    from aiida.orm import Dict
+    from aiida.orm.utils.links import LinkManager
+    from aiida_porousmaterials.calculations import PorousMaterialsCalculation
+    from aiida_porousmaterials.parser import PorousMaterialsParser
+
+    class StandInNode:
+        """The parts of a CalcJobNode the parser uses."""
+        process_class = PorousMaterialsCalculation
+        inputs = AttributeDict({'parameters': Dict(dict=PARAMETERS)})
+
+        @staticmethod
+        def get_incoming(**kwargs):  # pylint: disable=unused-argument
+            return LinkManager([])
+
+    class MemoryParser(PorousMaterialsParser):
+        """Parser reading a MemoryFolder instead of the retrieved node."""
+        retrieved = retrieved_folder(synthetic_files, num_nodes)
+
+    def parse():
+        parser = MemoryParser(StandInNode())
+        exit_code = parser.parse()
+        return exit_code, parser.outputs
+
+    exit_code, outputs = measure(parse)
+    assert exit_code.status == 0
+    assert sorted(outputs['ev_output_file']) == ['Ev_vdw_HKUST1_{0}_{0}'.format(ads) for ads in sorted(ADSORBATES)]
+
+
+# EOF
@@ -0,0 +1,107 @@
+"""
+Benchmark of `parse_base_output` against the previous
+readlines + read_csv + iterrows implementation on synthetic Ev files.
+
+The gain is in memory, not in time: both parsers are bound by reading the CSV, so the time ratio
+is close to one (about 0.9x at 10k nodes, 1.1x at 100k and 1.2x at 1M), while the peak memory at
+1M nodes goes from about 253 MB to 72 MB, and stays bounded with --chunksize.
+"""
+import functools
+import os
+import tempfile
+import timeit
+import tracemalloc
+
+import click
+import pandas as pd
+
+from aiida_porousmaterials.utils.base_parser import parse_base_output
+from synthetic import write_ev_csv
+
+
+def legacy_parse_base_output(output_abs_path):
+    """The implementation shipped up to 1.0.0a3, kept as the reference."""
+    K_to_kJ_mol = 1.0 / 120.273  # pylint: disable=invalid-name
+
+    with open(output_abs_path) as file:
+        lines = file.readlines()
+        density = float(lines[2])
+        temperature = float(lines[4])
+
+    df = pd.read_csv(output_abs_path, skiprows=5)  # pylint: disable=invalid-name
+    results = {}
+    results['energy_unit'] = 'kJ/mol'
+    total_num_nodes = df.shape[0]
+    minimum = df.Ev_K.min()
+    maximum = df.Ev_K.max()
+    df_min = df.loc[df.Ev_K == minimum]
+    df_max = df.loc[df.Ev_K == maximum]
+    results['Ev_minimum'] = minimum * K_to_kJ_mol
+    results['Ev_maximum'] = maximum * K_to_kJ_mol
+    results['minimum_nodes_props'] = {}
+    results['maximum_nodes_props'] = {}
+    results['header_nodes_props'] = ['Boltzmann_factor', 'Weighted_energy', 'radius', 'x', 'y', 'z']
+    for index, row in df_min.iterrows():
+        results['minimum_nodes_props']['node_' + str(index)] = [
+            row.boltzmann_factor, row.weighted_energy_K * K_to_kJ_mol, row.Rv_A, row.x, row.y, row.z
+        ]
+    for index, row in df_max.iterrows():
+        results['maximum_nodes_props']['node_' + str(index)] = [
+            row.boltzmann_factor, row.weighted_energy_K * K_to_kJ_mol, row.Rv_A, row.x, row.y, row.z
+        ]
+    results['coordinate_system'] = 'Cartesian'
+    results['framework_density'] = density
+    results['framework_density_unit'] = 'kg/m3'
+    results['temperature'] = temperature
+    results['temperature_unit'] = 'Kelvin'
+    results['radius_unit'] = 'Angstrom'
+    results['total_number_of_accessible_Voronoi_nodes'] = total_num_nodes
+    return results
+
+
+def best_of(func, path, repeat):
+    """Best wall time in seconds of `repeat` calls."""
+    return min(timeit.repeat(lambda: func(path), number=1, repeat=repeat))
+
+
+def peak_memory(func, path):
+    """Peak of the memory traced during one call, in MB."""
+    tracemalloc.start()
+    func(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024.**2
+
+
+@click.command('cli')
+@click.option('--sizes', default='10000,100000,1000000', help='Comma separated numbers of Voronoi nodes.')
+@click.option('--repeat', default=3, help='Number of timings per size, the best one is reported.')
+@click.option('--adsorbate', default='Xe', help='Adsorbate column to append, as the multi-component templates do.')
+@click.option('--chunksize', default=None, type=int, help='Stream the current parser in chunks of this many nodes.')
+def cli(sizes, repeat, adsorbate, chunksize):
+    """Time the legacy and current parser, check that they agree and compare their peak memory."""
+    workdir = tempfile.mkdtemp()
+    current_parser = functools.partial(parse_base_output, chunksize=chunksize)
+    print('{:>10} {:>12} {:>12} {:>10} {:>12} {:>12}'.format(
+        'nodes', 'legacy [s]', 'current [s]', 'time ratio', 'legacy [MB]', 'current [MB]'
+    ))
+    for size in [int(size) for size in sizes.split(',')]:
+        path = write_ev_csv(os.path.join(workdir, 'Ev_vdw_bench_{}.csv'.format(size)), size, adsorbate=adsorbate)
+        legacy_results = legacy_parse_base_output(path)
+        results = current_parser(path)
+        if any(results[key] != value for key, value in legacy_results.items()):
+            raise click.ClickException('Parsers disagree for {} nodes'.format(size))
+        legacy = best_of(legacy_parse_base_output, path, repeat)
+        current = best_of(current_parser, path, repeat)
+        print('{:>10} {:>12.4f} {:>12.4f} {:>9.1f}x {:>12.1f} {:>12.1f}'.format(
+            size, legacy, current, legacy / current, peak_memory(legacy_parse_base_output, path),
+            peak_memory(current_parser, path)
+        ))
+        os.remove(path)
+    os.rmdir(workdir)
+
+
+if __name__ == '__main__':
+    cli()  # pylint: disable=no-value-for-parameter
+
+# EOF
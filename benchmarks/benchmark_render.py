@@ -0,0 +1,87 @@
+"""
+Benchmark of `PorousMaterialsInput.render` against the previous implementation,
+which copied the parameters twice and re-read and re-parsed the template on every call.
+"""
+import os
+import timeit
+from copy import deepcopy
+from string import Template
+
+import click
+
+from aiida_porousmaterials.utils import input_generator
+from aiida_porousmaterials.utils.input_generator import PorousMaterialsInput, julia_list
+
+PARAMETERS = {
+    'data_path': '/path/to/data',
+    'ff': 'UFF.csv',
+    'cutoff': 12.5,
+    'mixing': 'Lorentz-Berthelot',
+    'framework': 'bench.cif',
+    'frameworkname': 'bench',
+    'adsorbate': 'Xe',
+    'adsorbates': julia_list(['Xe', 'Kr']),
+    'temperature': 298.0,
+    'output_filename': 'Ev_bench.csv',
+}
+
+
+def legacy_render(params):
+    """The render implementation shipped up to 1.0.0a3, plus the later defaults, preamble and epilogue."""
+    params = deepcopy(params)
+    params.setdefault('output_dir', 'Output')
+    params.setdefault('parallel', 'serial')
+    params.setdefault('energy_mode', 'direct')
+    params.setdefault('grid_points', 50)
+    params.setdefault('summary_setting', 'nothing')
+    if 'adsorbates' in params:
+        params.setdefault('pld_adsorbates', params['adsorbates'])
+    if params['input_template'] in input_generator.PLAN_TEMPLATES:
+        params.setdefault('plan', PorousMaterialsInput(params).params['plan'])
+
+    output = '### Generated by AiiDA ###'
+    params = deepcopy(params)
+    basepath = os.path.dirname(os.path.abspath(input_generator.__file__))
+    tmppath = '{}/templates/{}.jl'.format(basepath, params['input_template'])
+    with open('{}/templates/common/ev_nodes.jl'.format(basepath)) as functions:
+        output += functions.read()
+    with open(tmppath) as template:
+        lines = template.read()
+    return output + Template(lines).substitute(params) + input_generator.EPILOGUE
+
+
+def current_render(params):
+    """Validate and render as the calculation does."""
+    inp = PorousMaterialsInput(params)
+    if inp.missing_parameters():
+        raise ValueError('missing parameters')
+    return inp.render()
+
+
+def loop(func, params, builders):
+    """Render the input of `builders` builders, each for its own framework name."""
+    for index in range(builders):
+        func(dict(params, frameworkname='bench_{}'.format(index)))
+
+
+@click.command('cli')
+@click.option('--builders', default=10000, help='Number of inputs rendered per timing.')
+@click.option('--repeat', default=3, help='Number of timings, the best one is reported.')
+@click.option('--template', default='ev_vdw_kh_multicomp_pld_template', help='Name of the bundled template.')
+def cli(builders, repeat, template):
+    """Time rendering the input of many builders with the legacy and current implementation."""
+    params = dict(PARAMETERS, input_template=template)
+    if legacy_render(params) != current_render(params):
+        raise click.ClickException('Rendered inputs differ')
+    print('{:>10} {:>16} {:>16} {:>9}'.format('builders', 'legacy [us/op]', 'current [us/op]', 'speedup'))
+    legacy = min(timeit.repeat(lambda: loop(legacy_render, params, builders), number=1, repeat=repeat))
+    current = min(timeit.repeat(lambda: loop(current_render, params, builders), number=1, repeat=repeat))
+    print('{:>10} {:>16.1f} {:>16.1f} {:>8.1f}x'.format(
+        builders, 1e6 * legacy / builders, 1e6 * current / builders, legacy / current
+    ))
+
+
+if __name__ == '__main__':
+    cli()  # pylint: disable=no-value-for-parameter
+
+# EOF
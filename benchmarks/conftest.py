@@ -0,0 +1,89 @@
+"""
+Fixtures of the pytest-benchmark suite: synthetic inputs and outputs at
+several sizes and the peak memory of the benchmarked calls.
+The benchmarks needing AiiDA run on a test profile and are skipped without it.
+"""
+import os
+import tracemalloc
+
+import pytest
+
+from synthetic import write_ev_csv, write_voro_accessible
+
+try:
+    import aiida  # pylint: disable=unused-import
+    pytest_plugins = ['aiida.manage.tests.pytest_fixtures']  # pylint: disable=invalid-name
+except ImportError:
+
+    @pytest.fixture
+    def aiida_profile():
+        pytest.skip('aiida-core is not installed')
+
+    @pytest.fixture
+    def aiida_local_code_factory():
+        pytest.skip('aiida-core is not installed')
+
+
+def pytest_addoption(parser):
+    parser.addoption('--sizes', default='10000,100000', help='Comma separated numbers of Voronoi nodes.')
+    parser.addoption('--import-budget',
+                     type=float,
+                     default=0.15,
+                     help='Maximum import time in seconds of a plugin module once AiiDA is loaded.')
+
+
+def pytest_generate_tests(metafunc):
+    if 'num_nodes' in metafunc.fixturenames:
+        sizes = [int(size) for size in metafunc.config.getoption('sizes').split(',')]
+        metafunc.parametrize('num_nodes', sizes, ids=['{}_nodes'.format(size) for size in sizes])
+
+
+@pytest.fixture(scope='session')
+def synthetic_files(tmp_path_factory):
+    """Factory of synthetic files, each written once per session: (kind, num_nodes, adsorbate) -> path."""
+    workdir = tmp_path_factory.mktemp('synthetic')
+    paths = {}
+
+    def _synthetic_file(kind, num_nodes, adsorbate='Xe'):
+        key = (kind, num_nodes, adsorbate)
+        if key not in paths:
+            if kind == 'ev':
+                path = os.path.join(str(workdir), 'Ev_vdw_HKUST1_{0}_{0}_{1}.csv'.format(adsorbate, num_nodes))
+                paths[key] = write_ev_csv(path, num_nodes, adsorbate=adsorbate)
+            else:
+                path = os.path.join(str(workdir), 'HKUST1_{}_{}.voro_accessible'.format(adsorbate, num_nodes))
+                paths[key] = write_voro_accessible(path, num_nodes, label='HKUST1')
+        return paths[key]
+
+    return _synthetic_file
+
+
+# Peak memory of the benchmarks of the session, by name, in MB.
+PEAK_MEMORY = {}
+
+
+@pytest.fixture
+def measure(benchmark, request):
+    """
+    Benchmark func(*args, **kwargs) and record the peak of the memory traced
+    during one extra call, in MB, as `peak_memory_MB` of the benchmark.
+    """
+
+    def _measure(func, *args, **kwargs):
+        result = benchmark(func, *args, **kwargs)
+        tracemalloc.start()
+        func(*args, **kwargs)
+        PEAK_MEMORY[request.node.name] = tracemalloc.get_traced_memory()[1] / 1024.**2
+        tracemalloc.stop()
+        benchmark.extra_info['peak_memory_MB'] = PEAK_MEMORY[request.node.name]
+        return result
+
+    return _measure
+
+
+def pytest_terminal_summary(terminalreporter):
+    if PEAK_MEMORY:
+        terminalreporter.section('peak memory')
+        width = max(len(name) for name in PEAK_MEMORY)
+        for name, peak in sorted(PEAK_MEMORY.items()):
+            terminalreporter.write_line('{:<{}} {:>10.2f} MB'.format(name, width, peak))
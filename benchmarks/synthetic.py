@@ -0,0 +1,61 @@
+"""Generators of synthetic PorousMaterials inputs and outputs for benchmarking."""
+import numpy as np
+
+EV_HEADER = (
+    '!!!Generated results using aiida-porousmaterials plugin!!! nodes: {num_nodes}\n'
+    'Framework Density\n'
+    '{density}\n'
+    'Temperature(K)\n'
+    '{temperature}\n'
+)
+
+
+def ev_columns(num_nodes, temperature=298.0, seed=0):
+    """
+    Random, but physically shaped, per-node columns as written by the templates.
+    A few nodes share the minimum and maximum energy to exercise the tie handling.
+    """
+    rng = np.random.RandomState(seed)
+    energy = rng.normal(-1500.0, 800.0, num_nodes)
+    energy[rng.randint(0, num_nodes, 3)] = energy.min()
+    energy[rng.randint(0, num_nodes, 2)] = energy.max()
+    boltzmann_factor = np.exp(-energy / temperature)
+    return {
+        'Ev_K': energy,
+        'boltzmann_factor': boltzmann_factor,
+        'weighted_energy_K': boltzmann_factor * energy,
+        'Rv_A': rng.uniform(1.0, 6.0, num_nodes),
+        'x': rng.uniform(0.0, 26.3, num_nodes),
+        'y': rng.uniform(0.0, 26.3, num_nodes),
+        'z': rng.uniform(0.0, 26.3, num_nodes),
+    }
+
+
+def write_ev_csv(path, num_nodes, adsorbate=None, density=881.2, temperature=298.0, seed=0):
+    """Write an `Ev_vdw_*.csv` file with num_nodes rows."""
+    columns = ev_columns(num_nodes, temperature=temperature, seed=seed)
+    names = list(columns)
+    block = np.column_stack([columns[name] for name in names])
+    with open(path, 'w') as handle:
+        handle.write(EV_HEADER.format(num_nodes=num_nodes, density=density, temperature=temperature))
+        if adsorbate is None:
+            handle.write(','.join(names) + '\n')
+            np.savetxt(handle, block, delimiter=',', fmt='%.12g')
+        else:
+            handle.write(','.join(names + ['adsorbate']) + '\n')
+            np.savetxt(handle, block, fmt=','.join(['%.12g'] * len(names)) + ',' + adsorbate)
+    return path
+
+
+def write_voro_accessible(path, num_nodes, label='synthetic', probe_radius=1.985, seed=0):
+    """Write a Zeo++ `.voro_accessible` file with num_nodes nodes."""
+    rng = np.random.RandomState(seed)
+    block = np.column_stack([rng.uniform(0.0, 26.3, (num_nodes, 3)), rng.uniform(1.0, 6.0, num_nodes)])
+    with open(path, 'w') as handle:
+        handle.write('{}\n'.format(num_nodes))
+        handle.write('Voronoi accessible diagram for {} with probe radius {}\n'.format(label, probe_radius))
+        np.savetxt(handle, block, fmt='Ac %.3f %.3f %.3f %.3f')
+    return path
+
+
+# EOF
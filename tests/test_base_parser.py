@@ -0,0 +1,173 @@
+"""Tests of the reduction of the Ev output files and of their summaries."""
+import io
+import math
+
+import numpy as np
+import pytest
+
+from aiida_porousmaterials.utils.base_parser import (
+    DEFAULT_EV_SETTING, K_TO_KJ_MOL, EnergyHistogram, parse_base_output, parse_summary
+)
+from aiida_porousmaterials.utils.retrieved import MemoryFolder, parse_retrieved
+
+HEADER = (
+    '!!!Generated results using aiida-porousmaterials plugin!!! nodes: {}\n'
+    'Framework Density\n881.2\nTemperature(K)\n298.0\n'
+    'Ev_K,boltzmann_factor,weighted_energy_K,Rv_A,x,y,z\n'
+)
+# Summary written by `summarize` of the templates for a file without nodes.
+EMPTY_SUMMARY = {
+    'temperature': 298.0,
+    'density': 881.2,
+    'rows': 0,
+    'count': 0,
+    'minimum': None,
+    'maximum': None,
+    'minimum_nodes': [[], []],
+    'maximum_nodes': [[], []],
+    'boltzmann_factor_sum': 0.0,
+    'weighted_energy_sum': 0.0,
+    'by_temperature': [],
+}
+
+
+# Node energies (K) with tied extremes on both sides of the chunk boundaries of CHUNKSIZE,
+# below the default histogram range and on its bin edges (-80 and -100 kJ/mol).
+ENERGIES = [-3000.0, -1200.0, -15000.0, -15000.0, -9621.84, -250.0, -250.0, -500.0, -4000.0, -15000.0, -12027.3]
+CHUNKSIZE = 3
+
+
+def ev_file(energies, multiplicity=None, temperature=298.0, start=0):
+    """
+    Text of an Ev output file of the nodes with energies, radius and coordinates
+    from their index in the file of all the nodes, where the first one is at start.
+    """
+    columns = 'Ev_K,boltzmann_factor,weighted_energy_K,Rv_A,x,y,z' + (',multiplicity' if multiplicity else '')
+    lines = [HEADER.format(len(energies)).replace('298.0', repr(temperature)).rsplit('Ev_K', 1)[0] + columns]
+    for index, energy in enumerate(energies, start):
+        factor = math.exp(-energy / temperature)
+        row = [energy, factor, factor * energy, 1.0 + index / 10., index, 2. * index, 3. * index]
+        row += [multiplicity[index - start]] if multiplicity else []
+        lines.append(','.join(repr(value) for value in row))
+    return '\n'.join(lines) + '\n'
+
+
+def summarize(energies, multiplicity=None, temperature=298.0):
+    """Summary of the nodes of `ev_file`, as written by `summarize` of the templates."""
+    energies = np.asarray(energies)
+    weights = np.asarray(multiplicity or [1] * len(energies))
+    factors = np.exp(-energies / temperature)
+    rows = [[factors[k], factors[k] * energies[k], 1.0 + k / 10., k, 2. * k, 3. * k] for k in range(len(energies))]
+    order = np.argsort(energies, kind='stable')
+    cumulative = np.cumsum(weights[order])
+    percentiles = []
+    for percentile in DEFAULT_EV_SETTING:
+        position = percentile / 100 * (cumulative[-1] - 1)
+        lower = energies[order][np.searchsorted(cumulative, np.floor(position), side='right')]
+        upper = energies[order][np.searchsorted(cumulative, np.ceil(position), side='right')]
+        percentiles.append(lower + (upper - lower) * (position - np.floor(position)))
+    edges = EnergyHistogram().bin_edges
+    counts = np.zeros(len(edges) - 1, dtype=int)
+    for energy, weight in zip(energies * K_TO_KJ_MOL, weights):
+        if edges[0] <= energy <= edges[-1]:
+            counts[min(np.searchsorted(edges, energy, side='right') - 1, len(counts) - 1)] += weight
+    minimum = np.flatnonzero(energies == energies.min())
+    maximum = np.flatnonzero(energies == energies.max())
+    return {
+        'temperature': temperature,
+        'density': 881.2,
+        'rows': len(energies),
+        'count': int(weights.sum()),
+        'minimum': energies.min(),
+        'maximum': energies.max(),
+        'minimum_nodes': [minimum.tolist(), [rows[k] for k in minimum]],
+        'maximum_nodes': [maximum.tolist(), [rows[k] for k in maximum]],
+        'boltzmann_factor_sum': float((factors * weights).sum()),
+        'weighted_energy_sum': float((factors * energies * weights).sum()),
+        'percentiles': percentiles,
+        'bin_edges': edges.tolist(),
+        'counts': counts.tolist(),
+        'below': int(weights[energies * K_TO_KJ_MOL < edges[0]].sum()),
+        'above': int(weights[energies * K_TO_KJ_MOL > edges[-1]].sum()),
+        'by_temperature': [],
+    }
+
+
+def assert_close(actual, expected, path='results'):
+    """Nested results actual equal expected, numbers to a relative 1e-9."""
+    if isinstance(expected, dict):
+        assert sorted(actual) == sorted(expected), path
+        for key in expected:
+            assert_close(actual[key], expected[key], '{}[{!r}]'.format(path, key))
+    elif isinstance(expected, list):
+        assert len(actual) == len(expected), path
+        for index, (item, expected_item) in enumerate(zip(actual, expected)):
+            assert_close(item, expected_item, '{}[{}]'.format(path, index))
+    elif isinstance(expected, float):
+        assert actual == pytest.approx(expected, rel=1e-9, nan_ok=True), path
+    else:
+        assert actual == expected, path
+
+
+def assert_empty(results):
+    """results are those of a file without nodes."""
+    assert results['total_number_of_accessible_Voronoi_nodes'] == 0
+    assert math.isnan(results['Ev_minimum']) and math.isnan(results['Ev_maximum'])
+    assert math.isnan(results['Ev_boltzmann_average']) and math.isnan(results['average_boltzmann_factor'])
+    assert not results['minimum_nodes_props'] and not results['maximum_nodes_props']
+    assert 'Ev_percentiles' not in results and 'Ev_histogram' not in results
+
+
+@pytest.mark.parametrize('chunksize', [None, 4])
+def test_empty_file(chunksize):
+    """A probe reaching no Voronoi node leaves a file without rows, reported with NaN extremes."""
+    assert_empty(parse_base_output(io.StringIO(HEADER.format(0)), chunksize=chunksize))
+    results = parse_base_output(io.StringIO(HEADER.format(0)), chunksize=chunksize, temperatures=[298.0, 77.0])
+    for value in results.values():
+        assert_empty(value)
+
+
+@pytest.mark.parametrize('multiplicity', [None, [1, 2, 1, 1, 3, 1, 1, 2, 1, 1, 4]])
+def test_chunked_whole(multiplicity):
+    """Streaming in chunks gives the results of the whole file, extremes tied across chunks included."""
+    text = ev_file(ENERGIES, multiplicity)
+    whole = parse_base_output(io.StringIO(text))
+    chunked = parse_base_output(io.StringIO(text), chunksize=CHUNKSIZE)
+    assert sorted(whole['minimum_nodes_props']) == ['node_2', 'node_3', 'node_9']
+    assert sorted(whole['maximum_nodes_props']) == ['node_5', 'node_6']
+    # The percentiles of the chunks are estimated from the histogram, within a bin of the exact ones.
+    assert (whole['Ev_percentiles_method'], chunked['Ev_percentiles_method']) == ('exact', 'histogram')
+    for key, value in whole.pop('Ev_percentiles').items():
+        assert abs(chunked['Ev_percentiles'][key] - value) <= 2.0
+    chunked.pop('Ev_percentiles')
+    chunked['Ev_percentiles_method'] = 'exact'
+    assert_close(chunked, whole)
+
+
+@pytest.mark.parametrize('multiplicity', [None, [1, 2, 1, 1, 3, 1, 1, 2, 1, 1, 4]])
+def test_summary_file_parity(multiplicity):
+    """The summary written by the templates gives the results of the file it summarizes."""
+    expected = parse_base_output(io.StringIO(ev_file(ENERGIES, multiplicity)))
+    assert_close(parse_summary(summarize(ENERGIES, multiplicity)), expected)
+    assert expected['total_number_of_accessible_Voronoi_nodes'] == sum(multiplicity or [1] * len(ENERGIES))
+    histogram = expected['Ev_histogram']
+    assert histogram['below_range'] == 3
+    assert histogram['counts'][0] == (multiplicity or [1] * len(ENERGIES))[-1]
+
+
+def test_empty_summary():
+    """The summary of a file without nodes gives the results of the file."""
+    assert_empty(parse_summary(EMPTY_SUMMARY))
+    assert_empty(parse_summary(EMPTY_SUMMARY, temperatures=[298.0])['T_298K'])
+
+
+def test_empty_file_storable():
+    """The NaN results of a file without nodes are stored as None."""
+    folder = MemoryFolder({'Output/Ev_vdw_HKUST1_PLD_Xe.csv': HEADER.format(0)})
+    output_parameters, _ = parse_retrieved(folder, {'temperature': 298.0}, {})
+    results = output_parameters['Xe']['PLD_probe']
+    assert results['Ev_minimum'] is None and results['total_number_of_accessible_Voronoi_nodes'] == 0
+    assert np.isfinite(output_parameters['timings']['parse_s'])
+
+
+# EOF
@@ -0,0 +1,31 @@
+"""Tests of the npz storage of the per-node Ev results."""
+from functools import partial
+from types import SimpleNamespace
+
+import numpy as np
+
+from aiida_porousmaterials.utils.ev_arrays import load_ev_arrays, write_ev_arrays
+
+
+def test_round_trip(tmpdir):
+    """The arrays are loaded back memory-mapped in the nested layout, from the cache the second time."""
+    arrays = {
+        'HKUST1': {'Xe': {'Xe_probe': {'Ev_K': np.array([-1500.0, -1200.5]), 'x': np.array([1.0, 2.0])}}},
+        'IRMOF1': {'Kr': {'Xe_probe': {'Ev_K': np.array([], dtype=float), 'x': np.array([], dtype=float)}}},
+    }
+    path = write_ev_arrays(arrays, str(tmpdir.join('ev_output_arrays.npz')))
+    node = SimpleNamespace(uuid='test-round-trip', open=partial(open, path))
+    cache_dir = str(tmpdir.join('cache'))
+    for _ in range(2):
+        loaded = load_ev_arrays(node, cache_dir)
+        assert sorted(loaded) == ['HKUST1', 'IRMOF1']
+        for framework, adsorbate in [('HKUST1', 'Xe'), ('IRMOF1', 'Kr')]:
+            expected = arrays[framework][adsorbate]['Xe_probe']
+            columns = loaded[framework][adsorbate]['Xe_probe']
+            assert sorted(columns) == sorted(expected)
+            for column, array in expected.items():
+                assert isinstance(columns[column], np.memmap)
+                np.testing.assert_array_equal(columns[column], array)
+
+
+# EOF
@@ -0,0 +1,71 @@
+"""Tests of the flattening of the results to the rows of the exported table."""
+import csv
+
+import pytest
+
+pytest.importorskip('aiida')
+
+from aiida_porousmaterials.export import export_columns, result_rows, write_csv  # pylint: disable=wrong-import-position
+
+
+def results(minimum, temperature=298.0):
+    """Results of a (probe, adsorbate) pair as the parser gives them."""
+    return {
+        'Ev_minimum': minimum,
+        'Ev_maximum': 0.0,
+        'temperature': temperature,
+        'Ev_percentiles': {'90': minimum / 2, '50': minimum / 4},
+        'energy_mode': 'direct',
+        'minimum_nodes_props': {'node_0': [1.0, minimum]},
+    }
+
+
+OUTPUT_PARAMETERS = {
+    'Xe': {'Xe_probe': results(-20.0), 'Kr_probe': results(-15.0)},
+    'Voronoi_nodes_filter': {'HKUST1_Xe.voro_accessible': 0},
+    'timings': {'parse_s': 0.1},
+}
+
+
+def test_result_rows():
+    """Single calculations and batch mode give one row per (framework, probe, adsorbate)."""
+    rows = list(result_rows(OUTPUT_PARAMETERS, 'HKUST1'))
+    assert [(row['framework'], row['adsorbate'], row['probe']) for row in rows] == [
+        ('HKUST1', 'Xe', 'Xe'), ('HKUST1', 'Xe', 'Kr')
+    ]
+    assert rows[0]['Ev_minimum'] == -20.0 and rows[0]['Ev_percentile_90'] == -10.0
+    assert 'minimum_nodes_props' not in rows[0]
+
+    batch = {'HKUST1': {'Xe': OUTPUT_PARAMETERS['Xe']}, 'IRMOF1': {'Xe': {'Xe_probe': results(-10.0)}}}
+    assert [(row['framework'], row['probe']) for row in result_rows(batch)] == [
+        ('HKUST1', 'Xe'), ('HKUST1', 'Kr'), ('IRMOF1', 'Xe')
+    ]
+
+
+def test_result_rows_temperatures():
+    """The temperature level of several temperatures is told apart by the temperature column."""
+    output_parameters = {
+        'T_298K': {'HKUST1': {'Xe': {'Xe_probe': results(-20.0)}}},
+        'T_77_5K': {'HKUST1': {'Xe': {'Xe_probe': results(-20.0, 77.5)}}},
+    }
+    rows = list(result_rows(output_parameters))
+    assert [(row['framework'], row['adsorbate'], row['temperature']) for row in rows] == [
+        ('HKUST1', 'Xe', 298.0), ('HKUST1', 'Xe', 77.5)
+    ]
+    single = {'T_298K': {'Xe': {'Xe_probe': results(-20.0)}}}
+    assert [row['framework'] for row in result_rows(single, 'HKUST1')] == ['HKUST1']
+
+
+def test_write_csv(tmpdir):
+    """Rows are written under the export columns, missing results left empty."""
+    path = str(tmpdir.join('results.csv'))
+    rows = [dict(row, pk=1) for row in result_rows(OUTPUT_PARAMETERS, 'HKUST1')]
+    assert write_csv(iter(rows), path, export_columns([90, 80])) == 2
+    with open(path, newline='') as handle:
+        table = list(csv.DictReader(handle))
+    assert list(table[0]) == list(export_columns([90, 80]))
+    assert table[1]['probe'] == 'Kr' and float(table[1]['Ev_percentile_90']) == -7.5
+    assert table[1]['Ev_percentile_80'] == '' and table[1]['pk'] == '1'
+
+
+# EOF
@@ -0,0 +1,91 @@
+"""Tests of the generation of the evaluation plan and of the input of the templates."""
+from aiida_porousmaterials.utils.input_generator import EPILOGUE, PorousMaterialsInput, julia_list, plan_entries
+
+PARAMETERS = {
+    'data_path': '/path/to/data',
+    'ff': 'UFF.csv',
+    'cutoff': 12.5,
+    'mixing': 'Lorentz-Berthelot',
+    'framework': 'HKUST1.cif',
+    'frameworkname': 'HKUST1',
+    'adsorbates': julia_list(['Xe', 'Kr']),
+    'temperature': 298.0,
+    'input_template': 'ev_vdw_kh_multicomp_pld_template',
+}
+NODE_NAMES = ['HKUST1_Xe', 'HKUST1_Kr', 'HKUST1_PLD', 'HKUST1_N2']
+
+
+def test_plan_entries():
+    """Adsorbate probes are evaluated with their adsorbate, the other probes with the other adsorbates."""
+    assert plan_entries(NODE_NAMES, 'HKUST1', ['Xe', 'Kr'], ['Kr']) == [
+        ('Xe', 'HKUST1_Xe', ['Xe']),
+        ('Kr', 'HKUST1_Kr', ['Kr']),
+        ('N2', 'HKUST1_N2', ['Kr']),
+        ('PLD', 'HKUST1_PLD', ['Kr']),
+    ]
+    assert plan_entries(NODE_NAMES, 'HKUST1', ['Xe', 'Kr'], ['Kr'], probes=(False, True)) == [
+        ('N2', 'HKUST1_N2', ['Kr']),
+        ('PLD', 'HKUST1_PLD', ['Kr']),
+    ]
+    assert not plan_entries(NODE_NAMES, 'MOF5', ['Xe', 'Kr'], ['Kr'])
+
+
+def test_plan_entries_reused_pairs():
+    """Reused pairs are left out without changing how the probes of the other pairs are evaluated."""
+    entries = plan_entries(NODE_NAMES, 'HKUST1', ['Xe', 'Kr'], ['Kr'], reused_pairs=[('Xe', 'Xe'), ('PLD', 'Kr')])
+    assert entries == [('Kr', 'HKUST1_Kr', ['Kr']), ('N2', 'HKUST1_N2', ['Kr'])]
+
+
+def test_plan_of_incremental_input():
+    """The plan of an incremental calculation only holds the requested pairs which are not reused."""
+    parameters = dict(PARAMETERS, pld_adsorbates=julia_list(['Kr']), reused_pairs=[['Xe', 'Xe']])
+    inp = PorousMaterialsInput(parameters)
+    assert inp.params['plan'] == '[("Kr", "HKUST1_Kr.voro_accessible", ["Kr"]), ' \
+                                 '("PLD", "HKUST1_PLD.voro_accessible", ["Kr"])]'
+    assert not inp.missing_parameters()
+    assert 'plan = [("Kr"' in inp.render()
+
+
+def test_missing_parameters_of_plan():
+    """The parameters the plan is generated from are reported instead of the plan."""
+    parameters = dict(PARAMETERS)
+    del parameters['adsorbates']
+    assert PorousMaterialsInput(parameters).missing_parameters() == ['adsorbates']
+    assert PorousMaterialsInput({'input_template': 'ev_vdw_kh_pld_template'}).missing_parameters() == [
+        'adsorbates', 'cutoff', 'data_path', 'ff', 'framework', 'frameworkname', 'mixing', 'temperature'
+    ]
+
+
+def test_missing_node_files():
+    """The node files of the adsorbate probes must be given, unless their pair is reused."""
+    assert not PorousMaterialsInput(PARAMETERS).missing_node_files()
+    node_names = ['HKUST1_Xe', 'HKUST1_PLD']
+    assert PorousMaterialsInput(dict(PARAMETERS, node_names=node_names)).missing_node_files() == ['HKUST1_Kr']
+    parameters = dict(PARAMETERS, node_names=node_names, reused_pairs=[['Kr', 'Kr']])
+    assert not PorousMaterialsInput(parameters).missing_node_files()
+    parameters = dict(PARAMETERS, node_names=node_names, input_template='ev_vdw_kh_pld_template')
+    assert not PorousMaterialsInput(parameters).missing_node_files()
+    assert PorousMaterialsInput(dict(PARAMETERS, node_names=['MOF5_Xe'])).entries == []
+
+
+def test_output_files():
+    """The output files of the plan, under output_dir."""
+    inp = PorousMaterialsInput(dict(PARAMETERS, output_dir='Output/HKUST1', reused_pairs=[['PLD', 'Xe']]))
+    assert inp.output_files() == [
+        'Output/HKUST1/Ev_vdw_HKUST1_Xe_Xe.csv',
+        'Output/HKUST1/Ev_vdw_HKUST1_Kr_Kr.csv',
+        'Output/HKUST1/Ev_vdw_HKUST1_PLD_Kr.csv',
+    ]
+    parameters = dict(PARAMETERS, input_template='ev_vdw_kh_1comp_template', output_filename='Ev_HKUST1.csv')
+    assert PorousMaterialsInput(parameters).output_files() == ['Output/Ev_HKUST1.csv']
+    assert PorousMaterialsInput(dict(PARAMETERS, plan='[]')).output_files() is None
+
+
+def test_render_epilogue():
+    """The timings and summaries are written after the template, unless epilogue is False."""
+    inp = PorousMaterialsInput(PARAMETERS)
+    assert inp.render().endswith(EPILOGUE)
+    assert inp.render(epilogue=False) + EPILOGUE == inp.render()
+
+
+# EOF
@@ -0,0 +1,73 @@
+"""Tests of the hash of the physically relevant inputs of a calculation."""
+import io
+
+from aiida_porousmaterials.utils.input_hash import file_digest, input_hash, matching_outputs
+
+STRUCTURES = {'HKUST1': file_digest(io.BytesIO(b'data_HKUST1\n'))}
+NODES = {'HKUST1_Xe': file_digest(io.BytesIO(b'1\nHKUST1\nAc 0.000 0.000 0.000 1.000\n'))}
+PARAMETERS = {
+    'input_template': 'ev_vdw_kh_multicomp_template',
+    'adsorbates': '["Xe","Kr"]',
+    'cutoff': 12.5,
+    'temperature': 298,
+    'data_path': '/home/user/data',
+}
+
+
+def test_stable():
+    """The hash depends on the content of the inputs only, not on how they are written, and stays the same."""
+    reference = input_hash(STRUCTURES, NODES, PARAMETERS, {'output_storage': 'csv'})
+    parameters = dict(reversed(list(PARAMETERS.items())), temperature=298.0)
+    assert input_hash(STRUCTURES, NODES, parameters, {'output_storage': 'csv'}) == reference
+    assert reference == '26d2a75ddafeb7dd421c4affa28b2bb98988199dfe92ffd01bc7a86deb1d99c7'
+
+
+def test_path_independent():
+    """Paths on the remote, parallelism and how the code is run or parsed are left out."""
+    reference = input_hash(STRUCTURES, NODES, PARAMETERS)
+    parameters = dict(PARAMETERS, data_path='/scratch/data', parallel='threads')
+    settings = {'cmdline': ['--check-bounds=no'], 'parser_workers': 4, 'staging': 'archive', 'sysimage': 'pm.so'}
+    assert input_hash(STRUCTURES, NODES, parameters, settings) == reference
+    assert input_hash(STRUCTURES, NODES, dict(PARAMETERS, cutoff=14.0)) != reference
+    assert input_hash(STRUCTURES, NODES, PARAMETERS, {'histogram_bins': 20}) != reference
+    assert input_hash(STRUCTURES, NODES, PARAMETERS, data='digest') != reference
+
+
+def digest(text):
+    """Digest of a file of content text."""
+    return file_digest(io.BytesIO(text.encode('utf8')))
+
+
+def test_without_adsorbates():
+    """Calculations differing only by their adsorbates and the node files of their probes share the base hash."""
+    parameters = dict(PARAMETERS, adsorbates='["Ar"]')
+    nodes = dict(NODES, HKUST1_Ar=digest('Ar nodes'))
+    del nodes['HKUST1_Xe']
+    assert input_hash(STRUCTURES, nodes, parameters) != input_hash(STRUCTURES, NODES, PARAMETERS)
+    assert input_hash(STRUCTURES, nodes, parameters, with_adsorbates=False) == input_hash(
+        STRUCTURES, NODES, PARAMETERS, with_adsorbates=False
+    )
+    # The node file of another probe, evaluated with other adsorbates, is not left out.
+    nodes['HKUST1_Xe'] = NODES['HKUST1_Xe']
+    assert input_hash(STRUCTURES, nodes, parameters, with_adsorbates=False) != input_hash(
+        STRUCTURES, NODES, PARAMETERS, with_adsorbates=False
+    )
+
+
+def test_adding_adsorbate():
+    """A calculation adding an adsorbate and its probe reuses the output files of the others."""
+    previous_nodes = dict(NODES, HKUST1_PLD=digest('PLD nodes'))
+    previous = dict(PARAMETERS, adsorbates='["Xe"]')
+    nodes = dict(previous_nodes, HKUST1_Kr=digest('Kr nodes'))
+    assert input_hash(STRUCTURES, nodes, PARAMETERS, with_adsorbates=False) == input_hash(
+        STRUCTURES, previous_nodes, previous, with_adsorbates=False
+    )
+    names = ['Ev_vdw_HKUST1_Xe_Xe', 'Ev_vdw_HKUST1_PLD_Xe']
+    assert matching_outputs(names, nodes, previous_nodes) == names
+    # The output files of a probe whose node file changed are computed again.
+    changed = dict(nodes, HKUST1_Xe=digest('other Xe nodes'))
+    assert matching_outputs(names, changed, previous_nodes) == ['Ev_vdw_HKUST1_PLD_Xe']
+    assert not matching_outputs(names, nodes, {})
+
+
+# EOF
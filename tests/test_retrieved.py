@@ -0,0 +1,78 @@
+"""Tests of the parsing of the retrieved folder of a calculation."""
+import json
+import math
+
+import pytest
+
+from aiida_porousmaterials.utils.retrieved import (
+    MemoryFolder, list_output_files, missing_outputs, parse_retrieved, truncated_outputs
+)
+
+EV_FILE = (
+    '!!!Generated results using aiida-porousmaterials plugin!!! nodes: 1\n'
+    'Framework Density\n881.2\nTemperature(K)\n298.0\n'
+    'Ev_K,boltzmann_factor,weighted_energy_K,Rv_A,x,y,z\n'
+    '-1500.0,153.2,-229800.0,4.2,1.0,2.0,3.0\n'
+)
+OUTPUTS = ['Output/HKUST1/Ev_vdw_HKUST1_Xe_Xe.csv', 'Output/IRMOF1/Ev_vdw_IRMOF1_Xe_Xe.csv']
+
+
+def test_missing_outputs():
+    """The listed output files a batch run did not get to are reported."""
+    folder = MemoryFolder({'outputs.json': json.dumps(OUTPUTS), OUTPUTS[0]: EV_FILE})
+    assert missing_outputs(folder, list_output_files(folder, batch=True)) == OUTPUTS[1:]
+    folder = MemoryFolder({'outputs.json': json.dumps(OUTPUTS), OUTPUTS[0]: EV_FILE, OUTPUTS[1]: EV_FILE})
+    assert not missing_outputs(folder, list_output_files(folder, batch=True))
+
+
+def test_missing_outputs_summary():
+    """With the summary retrieval, the output files are found in the summaries."""
+    folder = MemoryFolder({'outputs.json': json.dumps(OUTPUTS), 'summary.json': json.dumps({OUTPUTS[1]: {}})})
+    assert missing_outputs(folder, list_output_files(folder, batch=True)) == OUTPUTS[:1]
+    assert not missing_outputs(MemoryFolder({'summary.json': '{}'}), [])
+
+
+def test_truncated_outputs():
+    """Output files with fewer rows than their banner announces, or a partial header, were truncated."""
+    folder = MemoryFolder({
+        OUTPUTS[0]: EV_FILE,
+        OUTPUTS[1]: EV_FILE.replace('nodes: 1', 'nodes: 2'),
+        'Output/MOF5/Ev_vdw_MOF5_Xe_Xe.csv': EV_FILE[:80],
+    })
+    assert truncated_outputs(folder, list_output_files(folder, batch=True)) == [
+        OUTPUTS[1], 'Output/MOF5/Ev_vdw_MOF5_Xe_Xe.csv'
+    ]
+    assert not truncated_outputs(MemoryFolder({OUTPUTS[0]: EV_FILE}), list_output_files(folder, batch=True)[:1])
+
+
+@pytest.mark.parametrize('chunksize', [None, 1])
+def test_parser_pools(chunksize):
+    """Output files parsed in a pool of processes, from copies of the objects, give the results of threads."""
+    folder = MemoryFolder({OUTPUTS[0]: EV_FILE, OUTPUTS[1]: EV_FILE.replace('-1500.0', '-1800.0')})
+    results = []
+    for pool in ['thread', 'process']:
+        settings = {'parser_pool': pool, 'parser_workers': 2, 'parser_chunksize': chunksize}
+        output_parameters, _ = parse_retrieved(folder, {'batch': True}, settings)
+        output_parameters.pop('timings')
+        results.append(output_parameters)
+    assert results[0] == results[1]
+    assert results[1]['IRMOF1']['Xe']['Xe_probe']['Ev_minimum'] == pytest.approx(-1800.0 / 120.273)
+
+
+def test_temperatures():
+    """
+    With a list of temperatures, the results are nested by temperature first, with the Boltzmann
+    factors of the file at its temperature and recomputed from the energies at the others.
+    """
+    folder = MemoryFolder({OUTPUTS[0]: EV_FILE, OUTPUTS[1]: EV_FILE, 'timings.json': '{}'})
+    output_parameters, _ = parse_retrieved(folder, {'batch': True, 'temperature': [298.0, 77.0]}, {})
+    assert sorted(output_parameters) == ['T_298K', 'T_77K', 'timings']
+    for key, temperature, factor in [('T_298K', 298.0, 153.2), ('T_77K', 77.0, math.exp(1500.0 / 77.0))]:
+        assert sorted(output_parameters[key]) == ['HKUST1', 'IRMOF1']
+        results = output_parameters[key]['HKUST1']['Xe']['Xe_probe']
+        assert results['temperature'] == temperature and results['energy_mode'] == 'direct'
+        assert results['average_boltzmann_factor'] == pytest.approx(factor)
+        assert results['Ev_minimum'] == pytest.approx(-1500.0 / 120.273)
+
+
+# EOF
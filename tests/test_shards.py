@@ -0,0 +1,51 @@
+"""Tests of the splitting of Voronoi node files into shards and of the merging of their outputs."""
+import io
+
+import pytest
+
+from aiida_porousmaterials.utils.base_parser import parse_base_output
+from aiida_porousmaterials.utils.shards import DEFAULT_SIZING, merge_ev_outputs, plan_shards, split_nodes
+
+from test_base_parser import ENERGIES, assert_close, ev_file
+
+VORONOI_NODES = '7\nHKUST1 unit cell\n' + ''.join(
+    'Ac {0}.000 {1}.000 {2}.000 {3}.500\n'.format(index, 2 * index, 3 * index, index % 3) for index in range(7)
+)
+
+
+@pytest.mark.parametrize('shards', [1, 2, 3, 7])
+def test_split_nodes(shards):
+    """The shards hold the nodes of the file once each, in the same order."""
+    texts = split_nodes(io.StringIO(VORONOI_NODES), shards)
+    assert len(texts) == shards
+    lines = [text.splitlines(True) for text in texts]
+    assert all(int(shard[0]) == len(shard) - 2 and shard[1] == 'HKUST1 unit cell\n' for shard in lines)
+    assert ''.join(line for shard in lines for line in shard[2:]) == ''.join(VORONOI_NODES.splitlines(True)[2:])
+
+
+@pytest.mark.parametrize('chunksize', [None, 4])
+@pytest.mark.parametrize('bounds', [[0, 11], [0, 5, 11], [0, 2, 3, 9, 11]])
+def test_merge_ev_outputs(bounds, chunksize):
+    """The merged outputs of the shards are the output of all the nodes, and give its results."""
+    multiplicity = [1, 2, 1, 1, 3, 1, 1, 2, 1, 1, 4]
+    handles = [
+        io.StringIO(ev_file(ENERGIES[start:stop], multiplicity[start:stop], start=start))
+        for start, stop in zip(bounds[:-1], bounds[1:])
+    ]
+    merged = io.StringIO()
+    merge_ev_outputs(handles, merged)
+    expected = ev_file(ENERGIES, multiplicity)
+    assert merged.getvalue() == expected
+    results = parse_base_output(io.StringIO(merged.getvalue()), chunksize=chunksize)
+    assert_close(results, parse_base_output(io.StringIO(expected), chunksize=chunksize))
+
+
+@pytest.mark.parametrize('max_shards', [0, 1, 16])
+def test_plan_shards(max_shards):
+    """At least one shard is planned, e.g. when a node file without nodes limits the shards to 0."""
+    shards, walltime = plan_shards(1.0e6, 1, dict(DEFAULT_SIZING, max_shards=max_shards))
+    assert shards == max(1, max_shards)
+    assert DEFAULT_SIZING['min_wallclock_seconds'] <= walltime <= DEFAULT_SIZING['max_wallclock_seconds']
+
+
+# EOF
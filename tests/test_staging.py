@@ -0,0 +1,25 @@
+"""Tests of the staging of the input files as a single compressed archive."""
+import io
+import tarfile
+
+from aiida_porousmaterials.utils.staging import file_opener, unpack_command, write_archive
+
+
+def test_write_archive(tmpdir):
+    """The members are streamed from their handles into the archive, with their sizes."""
+    source = tmpdir.join('HKUST1_Xe.voro_accessible')
+    source.write('1\nHKUST1\nAc 0.000 0.000 0.000 1.000\n')
+    members = [('HKUST1.cif', lambda: io.BytesIO(b'data_HKUST1\n')), (source.basename, file_opener(str(source)))]
+    path = write_archive(str(tmpdir.join('inputs.tar.gz')), members)
+    with tarfile.open(path, 'r:gz') as archive:
+        assert archive.getnames() == ['HKUST1.cif', 'HKUST1_Xe.voro_accessible']
+        assert archive.extractfile('HKUST1.cif').read() == b'data_HKUST1\n'
+        assert archive.extractfile(source.basename).read().decode('utf8') == source.read()
+
+
+def test_unpack_command():
+    """The archive is unpacked and removed."""
+    assert unpack_command('inputs.tar.gz') == 'tar xzf inputs.tar.gz && rm inputs.tar.gz'
+
+
+# EOF
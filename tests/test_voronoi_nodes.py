@@ -0,0 +1,81 @@
+"""Tests of the deduplication and selection of Voronoi nodes."""
+import io
+import os
+
+import numpy as np
+import pytest
+
+from aiida_porousmaterials.utils.voronoi_nodes import VoronoiNodes
+
+pytest.importorskip('scipy')
+
+NODES_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, 'examples', 'simple_calculations', 'files',
+    'HKUST1.voro_accessible'
+)
+HKUST1_CELL = np.eye(3) * 26.343
+
+
+def periodic_distances(xyz, centres, cell):
+    """Minimum image distances (Angstrom) between the rows of xyz and of centres."""
+    delta = (xyz - centres).dot(np.linalg.inv(cell))
+    delta -= np.round(delta)
+    return np.linalg.norm(delta.dot(cell), axis=1)
+
+
+def test_deduplicate_chain():
+    """A chain of close nodes is not merged into a single node, and periodic images are merged."""
+    cell = np.eye(3) * 10.0
+    xyz = np.array([[0.4 * index, 5.0, 5.0] for index in range(6)] + [[9.9, 5.0, 5.0]])
+    nodes = VoronoiNodes('chain', xyz, np.ones(len(xyz)))
+    reduced = nodes.deduplicate(cell, 0.5)
+    np.testing.assert_allclose(reduced.xyz[:, 0], [0.0, 0.8, 1.6])
+    assert reduced.multiplicity.tolist() == [3, 2, 2]
+    assert reduced.represented == len(xyz)
+
+
+@pytest.mark.parametrize('tolerance', [0.5, 1.0])
+def test_deduplicate_within_tolerance(tolerance):
+    """Every node of the file is within tolerance of the node it is merged into."""
+    with open(NODES_PATH) as handle:
+        nodes = VoronoiNodes.from_handle(handle)
+    reduced = nodes.deduplicate(HKUST1_CELL, tolerance)
+    assert reduced.represented == len(nodes.radii)
+    assert len(reduced.radii) < len(nodes.radii)
+
+    # Each representative is the first node of its group, which holds the nodes within tolerance of it.
+    first = [np.flatnonzero((nodes.xyz == centre).all(axis=1))[0] for centre in reduced.xyz]
+    assert first == sorted(first)
+    members = np.zeros(len(nodes.radii), dtype=bool)
+    for index, multiplicity in zip(first, reduced.multiplicity):
+        close = np.flatnonzero(~members & (periodic_distances(nodes.xyz, nodes.xyz[index], HKUST1_CELL) <= tolerance))
+        assert close[0] == index and len(close) == multiplicity
+        members[close] = True
+    assert members.all()
+
+
+def test_deduplicate_keeps_multiplicity():
+    """Deduplicating again counts the nodes of the original file."""
+    with open(NODES_PATH) as handle:
+        nodes = VoronoiNodes.from_handle(handle)
+    reduced = nodes.deduplicate(HKUST1_CELL, 0.2).deduplicate(HKUST1_CELL, 0.5)
+    assert reduced.represented == len(nodes.radii)
+
+
+def test_select_and_write():
+    """The largest nodes are kept in the order of the file, with their multiplicity."""
+    nodes = VoronoiNodes('nodes', np.arange(15.0).reshape(5, 3), np.array([1.0, 3.0, 2.0, 3.0, 0.5]),
+                         np.array([1, 2, 1, 4, 1]))
+    selected = nodes.select(min_radius=1.0, max_nodes=3)
+    assert selected.radii.tolist() == [3.0, 2.0, 3.0]
+    assert selected.multiplicity.tolist() == [2, 1, 4]
+    assert selected.represented == 7
+
+    handle = io.StringIO()
+    selected.write(handle)
+    handle.seek(0)
+    assert handle.readline() == '3\n' and handle.readline() == 'nodes\n'
+    assert handle.readline() == 'Ac 3.000 4.000 5.000 3.000 2\n'
+
+
+# EOF
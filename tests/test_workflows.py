@@ -0,0 +1,45 @@
+"""Tests of the merging of the shards of PorousMaterialsShardedWorkChain, run with a test profile."""
+import io
+import json
+
+import pytest
+
+from test_base_parser import ENERGIES, ev_file
+
+pytest.importorskip('aiida')
+
+from aiida.orm import Dict, FolderData  # pylint: disable=wrong-import-position
+from aiida_porousmaterials.workflows import (  # pylint: disable=wrong-import-position
+    PorousMaterialsShardedWorkChain, merge_shards
+)
+
+EV_KEY = 'Output/Ev_vdw_HKUST1_Xe_Xe.csv'
+
+
+def shard_folder(start, stop):
+    """Retrieved folder of the calculation of the nodes start to stop."""
+    folder = FolderData()
+    folder.put_object_from_filelike(io.StringIO(ev_file(ENERGIES[start:stop], start=start)), EV_KEY)
+    folder.put_object_from_filelike(io.StringIO(json.dumps({'total_s': 1.0})), 'timings.json')
+    return folder.store()
+
+
+def test_merged_shards(aiida_profile):  # pylint: disable=unused-argument
+    """The merged outputs of the shards are valid outputs of the workchain and those of all the nodes."""
+    parameters = Dict(dict={'temperature': 298.0}).store()
+    merged = merge_shards(parameters=parameters, shard_0=shard_folder(0, 5), shard_1=shard_folder(5, len(ENERGIES)))
+    outputs = {
+        'output_parameters': merged.pop('output_parameters'),
+        'ev_output_file': merged,
+    }
+    assert PorousMaterialsShardedWorkChain.spec().outputs.validate(outputs) is None
+
+    results = outputs['output_parameters'].get_dict()['Xe']['Xe_probe']
+    assert results['total_number_of_accessible_Voronoi_nodes'] == len(ENERGIES)
+    assert sorted(results['minimum_nodes_props']) == ['node_2', 'node_3', 'node_9']
+    assert len(outputs['output_parameters'].get_dict()['timings']['shards']) == 2
+    with outputs['ev_output_file']['Ev_vdw_HKUST1_Xe_Xe'].open(mode='r') as handle:
+        assert handle.read() == ev_file(ENERGIES)
+
+
+# EOF